@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro benchmarks for yakm. They need a running X server.
+
+Usage: python3 benchmark.py [name ...]
+Without arguments, all benchmarks except those in 'opt_in' are executed.
+"""
+
+import os
+import sys
+import queue
+import time
+import tempfile
+import contextlib
+from types import SimpleNamespace
+
+
+def percentile(values, p):
+    """Get the p-th percentile (0 <= p <= 100) of a list of values"""
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[idx]
+
+def report(name, times):
+    """Print p50/p99 of a list of durations in seconds"""
+    print("{:<30} n={:<7} p50={:8.2f}us p99={:8.2f}us".format(
+        name, len(times), percentile(times, 50) * 1e6, percentile(times, 99) * 1e6))
+
+@contextlib.contextmanager
+def count_calls(obj, name):
+    """Count the calls of the method 'name' of the object 'obj'"""
+    counter = SimpleNamespace(count=0)
+    original = getattr(obj, name)
+    # e.g., a method defined by the class of obj
+    inherited = name not in vars(obj)
+
+    def counting(*args, **kwargs):
+        counter.count += 1
+        return original(*args, **kwargs)
+
+    setattr(obj, name, counting)
+    try:
+        yield counter
+    finally:
+        if inherited:
+            delattr(obj, name)
+        else:
+            setattr(obj, name, original)
+
+def count_requests(disp):
+    """Count the X requests sent over the connection of an Xlib display"""
+    return count_calls(disp.display, "send_request")
+
+def load_navigator(conf_file="example_qwerty.conf", backend=None, **options):
+    """Load a configuration and start a key navigator, returns the yakm module and the navigator.
+    Use backend="xlib" to avoid the Gtk user interface.
+    The options overwrite the values of the configuration file."""
+    if backend == "xlib":
+        # makes 'import ui_gtk' fail
+        sys.modules["ui_gtk"] = None
+    import yakm
+    yakm.conf_dir = tempfile.mkdtemp() + "/"
+    yakm.configuration = {}
+    with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), conf_file)) as f_config:
+        yakm.exec_yakm(f_config.read(), yakm.configuration)
+    yakm.configuration.update(options)
+
+    return yakm, yakm.KeyNavigator()
+
+def press(nav, key):
+    """Execute the binding of a key synchronously"""
+    import input_devices
+    nav.input.bindings[input_devices.keymap.keycode(key)].fn()
+
+
+def bench_dispatch(count=20000):
+    """Replay synthetic KeyPress events into Input.handle_event and measure the dispatch time"""
+    import input_devices
+    from Xlib import X
+
+    inp = input_devices.Input()
+    try:
+        inp.register_key("a", lambda: None)
+        key_code, mod = input_devices.get_keycode("a")
+        evt = SimpleNamespace(type=X.KeyPress, detail=key_code, state=mod)
+
+        times = []
+        for _ in range(count):
+            start = time.perf_counter()
+            inp.handle_event(evt)
+            times.append(time.perf_counter() - start)
+
+            # keep the action queue from filling up
+            try:
+                inp.action_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+        report("dispatch KeyPress", times)
+        print("coalesced actions: {}".format(inp.coalesced_actions))
+    finally:
+        inp.stop()
+
+def bench_bindings(steps=200):
+    """Count key registrations and X requests per navigation step in dart mode"""
+    import input_devices
+    yakm, nav = load_navigator()
+    try:
+        press(nav, "mod4+h")
+        keys = ["q", "g"]
+
+        with count_calls(nav.input, "register_key") as registrations, \
+                count_requests(input_devices.disp) as requests:
+            for i in range(steps):
+                press(nav, keys[i % len(keys)])
+
+        print("{:<30} {:8.2f} registrations/step {:8.2f} X requests/step".format(
+            "dart navigation", registrations.count / steps, requests.count / steps))
+    finally:
+        nav.input.stop()
+
+def bench_history(steps=100000):
+    """Memory used by the undo history after many navigation steps"""
+    import tracemalloc
+    yakm, nav = load_navigator()
+    try:
+        press(nav, "mod4+f")
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        for i in range(steps):
+            nav.state.zone.x = i % 1000
+            nav.do_step(nav.state)
+        duration = time.perf_counter() - start
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print("{:<30} {} steps, {} snapshots, {:8.1f} KiB, {:8.2f}us/step".format(
+            "undo history", steps, len(nav.history), (after - before) / 1024, duration / steps * 1e6))
+    finally:
+        nav.input.stop()
+
+def bench_snapshot(count=2000):
+    """Cost of snapshots with 500 marks and 100 macros (which are not part of a snapshot),
+    compared with deep copies of the state and the marks and macros"""
+    import copy
+    yakm, nav = load_navigator()
+    try:
+        press(nav, "mod4+f")
+        state = nav.state
+
+        marks = yakm.open_store("marks")
+        for i in range(500):
+            marks.set("window " + str(i % 50), "abcdefghij"[i % 10], (i, 2 * i))
+        macros = yakm.open_store("macros")
+        for i in range(100):
+            macros.set("window " + str(i % 10), "klmnopqrst"[i % 10], {
+                    "position": [i, i], "command": ["move_left(0.5)", "warp", "click(1)"]})
+
+        def deep_copy():
+            # copy of the state as it was done before snapshots were introduced,
+            # when the marks and macros were part of the state
+            fields = dict((attr, copy.copy(getattr(state, attr))) for attr in state._snapshot_fields)
+            settings = copy.deepcopy({"MarkMode": marks.data, "MacroMode": macros.data})
+            return list(state.mode), state.zone.copy(), fields, settings
+
+        def deep_restore(snap):
+            mode, zone, fields, settings = snap
+            state.mode = list(mode)
+            state.zone = zone.copy()
+            for attr, value in fields.items():
+                setattr(state, attr, copy.copy(value))
+            # the restored marks and macros are only copied, the stores are not changed
+            copy.deepcopy(settings)
+
+        for name, take, restore in [
+                ("deepcopy", deep_copy, deep_restore),
+                ("snapshot", state.snapshot, state.restore)]:
+            snapshot_times = []
+            restore_times = []
+            for _ in range(count):
+                start = time.perf_counter()
+                snap = take()
+                snapshot_times.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                restore(snap)
+                restore_times.append(time.perf_counter() - start)
+
+            report(name + " take", snapshot_times)
+            report(name + " restore", restore_times)
+    finally:
+        nav.input.stop()
+
+def bench_idle(duration=5):
+    """Count the X requests per second of the Xlib user interface while grid mode is shown"""
+    yakm, nav = load_navigator(backend="xlib")
+    try:
+        press(nav, "mod4+f")
+        # let the user interface settle
+        time.sleep(1)
+
+        with count_requests(nav.ui.d) as requests:
+            time.sleep(duration)
+
+        print("{:<30} {:8.2f} X requests/s".format("idle grid mode (xlib)", requests.count / duration))
+    finally:
+        nav.ui.stop()
+        nav.input.stop()
+
+def bench_frame(count=100):
+    """Count the X requests of a frame of the Xlib user interface in dart mode"""
+    yakm, nav = load_navigator(backend="xlib")
+    try:
+        press(nav, "mod4+h")
+        time.sleep(1)
+
+        times = []
+        with count_requests(nav.ui.d) as requests:
+            for _ in range(count):
+                start = time.perf_counter()
+                nav.ui.redraw()
+                times.append(time.perf_counter() - start)
+
+        report("dart mode frame (xlib)", times)
+        print("{:<30} {:8.2f} X requests/frame".format("", requests.count / count))
+    finally:
+        nav.ui.stop()
+        nav.input.stop()
+
+def bench_grid(count=200):
+    """Time of GridMode.apply for 9x9 and 26x26 grids, with and without cached layout"""
+    import string
+    yakm, nav = load_navigator()
+    try:
+        yakm.configuration["grid_nav_chars"] = list(string.ascii_lowercase)
+        yakm.configuration["dart_nav_chars"] = [list(string.ascii_lowercase)] * 26
+        press(nav, "mod4+f")
+        yakm.full(nav.state)
+
+        for size in [9, 26]:
+            yakm.grid(size, size)(nav.state)
+            mode = nav.state.mode[-1]
+            for grid_nav in ["row", "dart"]:
+                mode.grid_nav = grid_nav
+                for cached in [False, True]:
+                    times = []
+                    for _ in range(count):
+                        if not cached:
+                            yakm.grid_layout.cache_clear()
+                        start = time.perf_counter()
+                        mode.apply(nav.state)
+                        times.append(time.perf_counter() - start)
+                    report("apply {0}x{0} {1} {2}".format(size, grid_nav, cached and "cached" or "uncached"), times)
+            nav.state.exit_mode(all_modes=True)
+            press(nav, "mod4+f")
+            yakm.full(nav.state)
+    finally:
+        nav.input.stop()
+
+def bench_allocations(steps=5000, interval=1000):
+    """Memory allocated by the drawn actions during a long navigation session in grid mode"""
+    import tracemalloc
+    import ui
+    yakm, nav = load_navigator()
+    try:
+        press(nav, "mod4+f")
+        keys = ["q", "w", "e", "a", "s", "d", "z", "x", "c"]
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(steps):
+            # go back to the full screen from time to time, so that the zone does not get too small
+            if i % 3 == 0:
+                yakm.full(nav.state)
+            press(nav, keys[i % len(keys)])
+            if (i + 1) % interval == 0:
+                current = tracemalloc.get_traced_memory()[0]
+                pooled = sum(len(pool) for pool in ui._pools.values())
+                print("{:<30} {:>7} steps {:8.1f} KiB, {} pooled actions".format(
+                    "grid navigation", i + 1, (current - before) / 1024, pooled))
+        tracemalloc.stop()
+    finally:
+        nav.input.stop()
+
+def bench_logging(steps=2000):
+    """Time per keystroke in dart mode for several log levels. The log output is discarded."""
+    import common
+    yakm, nav = load_navigator()
+    devnull = open(os.devnull, "w")
+    streams = [(handler, handler.setStream(devnull))
+               for log in common.loggers.values() for handler in log.handlers]
+    try:
+        press(nav, "mod4+h")
+        keys = ["q", "g"]
+
+        for level in ["trace", "debug", "info", "warning"]:
+            common.set_log_level(level)
+            times = []
+            for i in range(steps):
+                start = time.perf_counter()
+                press(nav, keys[i % len(keys)])
+                times.append(time.perf_counter() - start)
+            report("keystroke at " + level, times)
+    finally:
+        for handler, stream in streams:
+            handler.setStream(stream)
+        nav.input.stop()
+
+def bench_startup(runs=5):
+    """Time from interpreter start until the global hotkeys are grabbed, with a lazy and a preloaded user interface.
+    Every run uses a new interpreter with -X importtime, the slowest imports of the last run are shown."""
+    import subprocess
+    script = ("import time; start = time.perf_counter(); import benchmark; "
+              "benchmark.load_navigator(preload_ui={}); "
+              "print(time.perf_counter() - start, flush=True); import os; os._exit(0)")
+    cwd = os.path.dirname(os.path.realpath(__file__))
+
+    for preload in [False, True]:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-X", "importtime", "-c", script.format(preload)],
+                                    cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True, check=True)
+            total = time.perf_counter() - start
+            times.append((total, float(result.stdout.split()[-1])))
+
+        name = "startup " + (preload and "preloaded ui" or "lazy ui")
+        print("{:<30} hotkeys ready after {:8.1f}ms (process start), {:8.1f}ms (after interpreter init)".format(
+            name, percentile([t[0] for t in times], 50) * 1e3, percentile([t[1] for t in times], 50) * 1e3))
+
+        # lines: "import time: self [us] | cumulative | imported package"
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            fields = line[len("import time:"):].split("|")
+            if not fields[1].strip().isdigit():
+                continue
+            imports.append((int(fields[1]), fields[2].strip()))
+        for cumulative, module in sorted(imports, reverse=True)[:5]:
+            print("{:<30} {:8.1f}ms {}".format("", cumulative / 1e3, module))
+
+def bench_store(sizes=(100, 1000, 10000), count=1000):
+    """Time to save one mark and to load the store, for several numbers of marks"""
+    import store
+    for size in sizes:
+        path = os.path.join(tempfile.mkdtemp(), "marks")
+        marks = store.Store(path)
+        for i in range(size):
+            marks.set("window " + str(i % 100), "mark " + str(i), (i, 2 * i))
+
+        times = []
+        for i in range(count):
+            start = time.perf_counter()
+            marks.set("window " + str(i % 100), "mark " + str(i), (i, i))
+            times.append(time.perf_counter() - start)
+        marks.close()
+        report("save 1 of {} marks".format(size), times)
+
+        times = []
+        for _ in range(10):
+            start = time.perf_counter()
+            store.Store(path).close()
+            times.append(time.perf_counter() - start)
+        report("load {} marks".format(size), times)
+
+def bench_roundtrips(steps=200):
+    """Count the X round trips and pointer queries per keystroke in grid mode"""
+    import input_devices
+    from Xlib.protocol import rq
+    yakm, nav = load_navigator()
+    try:
+        press(nav, "mod4+f")
+        keys = ["a", "s", "d", "f"]
+
+        with count_calls(rq.ReplyRequest, "reply") as replies, \
+                count_calls(nav.input, "query_pointer") as queries:
+            for i in range(steps):
+                # as for a keystroke, see Input.run_batch
+                nav.input.invalidate_pointer()
+                press(nav, keys[i % len(keys)])
+
+        print("{:<30} {:8.2f} round trips/keystroke {:8.2f} pointer queries/keystroke".format(
+            "grid navigation", replies.count / steps, queries.count / steps))
+    finally:
+        nav.input.stop()
+
+def bench_window(count=1000):
+    """Round trips and time of Input.window, with the cached description and after a focus change"""
+    import input_devices
+    from Xlib.protocol import rq
+    inp = input_devices.Input()
+    try:
+        for name, invalidate in [("focus changed", True), ("cached", False)]:
+            times = []
+            with count_calls(rq.ReplyRequest, "reply") as replies:
+                for _ in range(count):
+                    if invalidate:
+                        # as for a PropertyNotify event of _NET_ACTIVE_WINDOW
+                        inp._window = None
+                    start = time.perf_counter()
+                    inp.window()
+                    times.append(time.perf_counter() - start)
+            report("window " + name, times)
+            print("{:<30} {:8.2f} round trips/call".format("", replies.count / count))
+    finally:
+        inp.stop()
+
+def bench_filter(conditions=500, count=1000):
+    """Time to get the marks for a window with many conditions: linear scan, matcher, and cached result"""
+    import store
+    marks = store.Store()
+    for i in range(conditions):
+        marks.set("application " + str(i), "abcdefghij"[i % 10], (i, 2 * i))
+    marks.set("", "z", (0, 0))
+    windows = [str({"name": "document " + str(i), "class": ("application " + str(i * 7),)})
+               for i in range(50)]
+
+    def linear(win):
+        # as it was done before the matcher was introduced
+        result = {}
+        win = win.lower()
+        for cond, bindings in marks.items():
+            if cond.lower() in win:
+                result.update(bindings)
+        return result
+
+    def uncached(win):
+        marks.lookups = {}
+        return marks.lookup(win)
+
+    for name, fn in [("linear scan", linear), ("matcher", uncached), ("cached", marks.lookup)]:
+        times = []
+        for i in range(count):
+            win = windows[i % len(windows)]
+            start = time.perf_counter()
+            fn(win)
+            times.append(time.perf_counter() - start)
+        report("filter {} conditions {}".format(conditions, name), times)
+
+def bench_typing(count=20):
+    """Time to type a sentence of 200 characters with XTest, compared with an xdotool process.
+    The keys are sent to the focused window, so this benchmark only runs when it is named explicitly."""
+    import shutil
+    import subprocess
+    import input_devices
+    text = ("The quick brown fox jumps over the lazy dog. " * 5)[:200]
+
+    inp = input_devices.Input()
+    try:
+        typers = [("XTest", inp.type_text)]
+        if shutil.which("xdotool"):
+            typers.append(("xdotool", lambda text: subprocess.call(["xdotool", "type", text])))
+
+        for name, type_text in typers:
+            times = []
+            for _ in range(count):
+                start = time.perf_counter()
+                type_text(text)
+                times.append(time.perf_counter() - start)
+            report("type 200 characters " + name, times)
+    finally:
+        inp.stop()
+
+
+benchmarks = {
+    "dispatch": bench_dispatch,
+    "bindings": bench_bindings,
+    "history": bench_history,
+    "snapshot": bench_snapshot,
+    "idle": bench_idle,
+    "frame": bench_frame,
+    "grid": bench_grid,
+    "allocations": bench_allocations,
+    "logging": bench_logging,
+    "startup": bench_startup,
+    "store": bench_store,
+    "roundtrips": bench_roundtrips,
+    "window": bench_window,
+    "filter": bench_filter,
+    "typing": bench_typing,
+}
+
+# benchmarks with side effects, e.g., typing into the focused window
+opt_in = {"typing"}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or [name for name in benchmarks if name not in opt_in]
+    for name in names:
+        benchmarks[name]()
+
+    # stop application (incl. all threads)
+    os._exit(0)
@@ -1,25 +1,54 @@
 
+import os
 import logging
 import contextlib
 from collections import namedtuple
 
+# add trace level (https://stackoverflow.com/a/13638084/1562506)
+TRACE = 9
+logging.addLevelName(TRACE, "TRACE")
+def _trace(self, message, *args, **kws):
+    # Yes, logger takes its '*args' as 'args'.
+    if self.isEnabledFor(TRACE):
+        self._log(TRACE, message, args, **kws)
+logging.Logger.trace = _trace
+
+def parse_log_level(level):
+    """Convert a level name (e.g., "debug") or number into a logging level"""
+    if isinstance(level, int):
+        return level
+
+    result = logging.getLevelName(str(level).upper())
+    if not isinstance(result, int):
+        raise ValueError("unknown log level " + str(level))
+    return result
+
+# all loggers created by logger(name)
+loggers = {}
+# the environment variable YAKM_LOG_LEVEL overrides the default level
+try:
+    log_level = parse_log_level(os.environ.get("YAKM_LOG_LEVEL", "WARNING"))
+except ValueError as error:
+    print("WARNING: " + str(error) + " in YAKM_LOG_LEVEL, using WARNING")
+    log_level = logging.WARNING
+
+def set_log_level(level):
+    """Change the level of all loggers, e.g., set_log_level("debug")"""
+    global log_level
+    log_level = parse_log_level(level)
+    for log in loggers.values():
+        log.setLevel(log_level)
+
 def logger(name):
     # setup logger
     logger = logging.getLogger(name)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('%(asctime)-23s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.DEBUG)
-
-    # add trace level (https://stackoverflow.com/a/13638084/1562506)
-    TRACE = 9
-    logging.addLevelName(TRACE, "TRACE")
-    def trace(self, message, *args, **kws):
-        # Yes, logger takes its '*args' as 'args'.
-        if self.isEnabledFor(TRACE):
-            self._log(TRACE, message, args, **kws)
-    logging.Logger.trace = trace
+    if name not in loggers:
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(asctime)-23s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s')
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        loggers[name] = logger
+    logger.setLevel(log_level)
     return logger
 
 _logger = logger(__name__)
@@ -68,6 +97,78 @@ def iter_first_last(iterator):
     yield prev, first, True
 
 
+class AhoCorasick:
+    """Automaton which finds all patterns that occur in a text with a single pass over the text.
+    Usage: AhoCorasick(["foo", "bar"]).matches("foobar") returns {0, 1} (the indices of the patterns)
+    """
+
+    def __init__(self, patterns):
+        # node: transitions (char -> node), failure link, indices of the patterns that end at this node
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+
+        for idx, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].add(idx)
+
+        # breadth first, so that the failure links of shorter prefixes are known
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0) if node else 0
+                self.output[child] |= self.output[self.fail[child]]
+
+    def matches(self, text):
+        """Get the indices of the patterns that occur in the text"""
+        result = set(self.output[0])
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            result |= self.output[node]
+        return result
+
+
+def partial_command(name, fn, n):
+    """Convert fn(arg1, ..., argn, state) into a function that takes n arguments and returns a command.
+    Commands are cached, so that the same arguments result in the same command object"""
+
+    cache = {}
+    def wrap(*args):
+        if len(args) != n:
+            _logger.error("wrong number of parameters for command %s expected %d, got %d", name, n, len(args))
+
+        try:
+            # also compare types, e.g., 1 and 1.0 should give different string representations
+            key = tuple((type(a), a) for a in args)
+            return cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable arguments
+            key = None
+
+        cmd = annotate(lambda state: fn(*args, state), name + "(" + ",".join([str(a) for a in args]) + ")")
+        if key is not None:
+            cache[key] = cmd
+        return cmd
+
+    return wrap
+
+
 @contextlib.contextmanager
 def command_definitions(globals):
     # save previouslydefined functions
@@ -91,13 +192,7 @@ def command_definitions(globals):
             fn = annotate(fn, fn.__name__)
         else:
             # partially apply 'argcount-1' parameters
-            def wrap(*args, name=name, n=argcount-1, fn=fn):
-                if len(args) != n:
-                    _logger.error("wrong number of parameters for command %s expected %d, got %d", name, n, len(args))
-
-                return annotate(lambda state: fn(*args, state), name + "(" + ",".join([str(a) for a in args]) + ")")
-
-            fn = wrap
+            fn = partial_command(name, fn, argcount-1)
 
         globals()[name] = fn
 
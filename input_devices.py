@@ -3,18 +3,19 @@
 
 import traceback
 import threading
-from time import sleep
 import queue
+import os
+import select
 from os import _exit
 
 import Xlib
-from Xlib import X, display, XK
+import Xlib.error
+from Xlib import X, display, XK, Xatom
 from Xlib.ext.xtest import fake_input
 
 import common
 from common import Coord
 logger = common.logger(__name__)
-logger.setLevel(common.logging.WARNING)
 
 key_mods = {
     "shift": X.ShiftMask,
@@ -45,7 +46,28 @@ disp = Xlib.display.Display()
 screen = disp.screen()
 root = screen.root
 
-def get_keycode(key):
+# properties which change the focused window or its description
+NET_ACTIVE_WINDOW = disp.intern_atom("_NET_ACTIVE_WINDOW")
+WM_NAME_ATOMS = {Xatom.WM_NAME, Xatom.WM_CLASS, disp.intern_atom("_NET_WM_NAME")}
+
+# names of modifier keys for Input.press_key (like xdotool)
+key_aliases = {
+    "ctrl": "Control_L", "control": "Control_L", "shift": "Shift_L",
+    "alt": "Alt_L", "meta": "Meta_L", "super": "Super_L",
+}
+
+def char_to_keysym(char):
+    """Get the keysym which types a character"""
+    if char in keys_to_code:
+        return XK.string_to_keysym(keys_to_code[char])
+
+    code = ord(char)
+    # Latin-1 characters have the same value as their keysym
+    if 0x20 <= code <= 0x7e or 0xa0 <= code <= 0xff:
+        return code
+    return 0x01000000 | code
+
+def _parse_keycode(key):
     mod = X.NONE
     for p in key.split("+"):
         if p in key_mods:
@@ -57,9 +79,122 @@ def get_keycode(key):
     key_code = disp.keysym_to_keycode(key_sym)
     return key_code, mod
 
+class KeyMap:
+    """Table from key specifications (e.g. "ctrl+a") to (key code, mod mask), and from key codes to keysyms.
+    The keysyms of all key codes are read once, key specifications are resolved on their first use.
+    The table has to be invalidated when the keyboard mapping changes (MappingNotify)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # spare key codes that we have mapped to a keysym, see stroke()
+        self.remapped = {}
+        # key codes for stroke(), the next one to use first
+        self.spare_codes = []
+        self.invalidate()
+
+    def invalidate(self):
+        """Rebuild the table from the current keyboard mapping of the display"""
+        info = disp.display.info
+        first = info.min_keycode
+        count = info.max_keycode - info.min_keycode + 1
+        mapping = disp.get_keyboard_mapping(first, count)
+
+        code_to_keysym = {}
+        keysym_to_stroke = {}
+        unmapped_codes = set()
+        for offset, keysyms in enumerate(mapping):
+            code = first + offset
+            if keysyms and keysyms[0]:
+                code_to_keysym[code] = XK.keysym_to_string(keysyms[0])
+            if not any(keysyms):
+                unmapped_codes.add(code)
+
+            # the first two levels: without and with shift
+            for level, keysym in enumerate(keysyms[:2]):
+                if keysym:
+                    keysym_to_stroke.setdefault(keysym, (code, level and X.ShiftMask))
+
+        # a key code for every modifier mask
+        modifier_codes = {}
+        for idx, codes in enumerate(disp.get_modifier_mapping()):
+            codes = [c for c in codes if c]
+            if codes:
+                modifier_codes[1 << idx] = codes[0]
+
+        with self.lock:
+            # keep the keysyms assigned by stroke(), the mapping might have been read before a remap
+            for code, keysym in self.remapped.items():
+                keysym_to_stroke[keysym] = (code, 0)
+                code_to_keysym[code] = XK.keysym_to_string(keysym)
+            # keep the round robin order, so that the code of the last remap is not reused next
+            spare = unmapped_codes | set(self.remapped)
+            spare_codes = sorted(spare - set(self.spare_codes)) + [c for c in self.spare_codes if c in spare]
+
+            self.code_to_keysym = code_to_keysym
+            self.keysym_to_stroke = keysym_to_stroke
+            self.spare_codes = spare_codes
+            self.modifier_codes = modifier_codes
+            self.spec_to_code = {}
+
+    def keycode(self, key):
+        """Get (key code, mod mask) for a key specification"""
+        try:
+            return self.spec_to_code[key]
+        except KeyError:
+            pass
+
+        result = _parse_keycode(key)
+        with self.lock:
+            self.spec_to_code[key] = result
+        return result
+
+    def keysym(self, key_code):
+        """Get the name of the (unmodified) keysym of a key code"""
+        return self.code_to_keysym.get(key_code)
+
+    def stroke(self, keysym):
+        """Get (key code, mod mask) which types a keysym, or None, and whether the keyboard mapping was changed.
+        If no key produces the keysym, it is assigned to a spare key code (one without keysyms).
+        Then the caller has to sync the display before typing the key.
+        The spare key codes are reused in a round robin fashion."""
+        try:
+            return self.keysym_to_stroke[keysym], False
+        except KeyError:
+            pass
+
+        with self.lock:
+            if not self.spare_codes:
+                logger.warning("no spare key code to type keysym %s", keysym)
+                return None, False
+
+            code = self.spare_codes.pop(0)
+            self.spare_codes.append(code)
+            prev = self.remapped.get(code)
+            if prev is not None:
+                self.keysym_to_stroke.pop(prev, None)
+
+            disp.change_keyboard_mapping(code, [(keysym, keysym)])
+            self.remapped[code] = keysym
+            self.keysym_to_stroke[keysym] = (code, 0)
+            self.code_to_keysym[code] = XK.keysym_to_string(keysym)
+
+        return (code, 0), True
+
+    def restore(self):
+        """Remove the keysyms that stroke() assigned to spare key codes"""
+        with self.lock:
+            for code in self.remapped:
+                disp.change_keyboard_mapping(code, [(X.NoSymbol, X.NoSymbol)])
+            self.remapped = {}
+        disp.flush()
+
+keymap = KeyMap()
+
+def get_keycode(key):
+    return keymap.keycode(key)
+
 def get_keysym(key_code):
-    key_sym = disp.keycode_to_keysym(key_code, 0)
-    return XK.keysym_to_string(key_sym)
+    return keymap.keysym(key_code)
 
 
 
@@ -70,47 +205,80 @@ def ignore_mod(mods=[X.LockMask, X.Mod2Mask], mod=0):
         yield from ignore_mod(mods[1:], mod)
         yield from ignore_mod(mods[1:], mod|mods[0])
 
-def grab_key(key_code, mod):
+def grab_key(key_code, mod, onerror=None):
     for i in ignore_mod():
-        root.grab_key(key_code, mod|i, False, X.GrabModeAsync, X.GrabModeAsync)
+        root.grab_key(key_code, mod|i, False, X.GrabModeAsync, X.GrabModeAsync, onerror=onerror)
 
-def ungrab_key(key_code, mod):
+def ungrab_key(key_code, mod, onerror=None):
     for i in ignore_mod():
-        root.ungrab_key(key_code, mod|i)
+        root.ungrab_key(key_code, mod|i, onerror=onerror)
+
+# put into the action queue to terminate the action thread
+_stop_marker = object()
 
 class Binding:
     key = None
     fn = None
+    # the action from which fn was created, used to detect changed bindings
+    action = None
+    _global = False
 
 
 class Input:
     def __init__(self):
         self.active = True
-        self.event_thread = threading.Thread(name='input event thread', target=self.event_loop)
-        self.event_thread.start()
+
+        # writing to this pipe wakes up the event thread (see stop)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        # if the pipe is full, the event thread wakes up anyway
+        os.set_blocking(self._wakeup_w, False)
+        # the write end is closed by the event thread when it exits, see wakeup()
+        self._wakeup_lock = threading.Lock()
 
         # use a different thread for executing the actions
         # reason: the event thread needs to receive the key release event so that ungrab_keyboard works for input_dialog
         self.action_queue = queue.Queue(1000)
-        self.action_thread = threading.Thread(name='input action thread',
-                        target=self.action_loop)
-        self.action_thread.start()
+        # called with a list of queued actions, see run_batch
+        self.batch_handler = None
+        # number of actions which were executed together with a previous action
+        self.coalesced_actions = 0
 
         self.grabbing = False
         self.bindings = {}
 
+        # pointer position and the window below it, see pointer() and window()
+        self._pointer = None
+        self._pointer_window = None
+        # description of the focused window, reset by PropertyNotify events (see window())
+        self._window = None
+        self._window_generation = 0
+        self._active_window = None
+        root.change_attributes(event_mask=X.PropertyChangeMask)
+
+        # set to stop the current glide, see glide()
+        self._glide_stopped = None
+        self._glide_target = None
+        self._glide_lock = threading.Lock()
+
         geo = root.get_geometry()
 
         self.w = geo.width
         self.h = geo.height
 
+        # the threads are started last, as they use the attributes above
+        self.event_thread = threading.Thread(name='input event thread', target=self.event_loop)
+        self.event_thread.start()
+        self.action_thread = threading.Thread(name='input action thread',
+                        target=self.action_loop)
+        self.action_thread.start()
+
     def handle_event(self, evt):
         try:
             if evt.type == X.KeyPress:
                 key_code = evt.detail
                 mod = evt.state & ~(X.LockMask | X.Mod2Mask | X.Button1Mask | X.Button2Mask | X.Button3Mask | X.Button4Mask | X.Button5Mask) # todo
-                pressed_key =  get_keysym(evt.detail)
-                logger.debug("pressed " + str(pressed_key))
+                pressed_key = keymap.keysym(key_code)
+                logger.debug("pressed %s", pressed_key)
 
                 k = (key_code, mod)
                 if k in self.bindings:
@@ -121,7 +289,7 @@ class Input:
                         if mod & mask == mask:
                             mod_desc += [desc]
 
-                    logger.warn("unbound key with key code " + str(key_code) + " and mod mask " + str(mod) + " " + "+".join(mod_desc) )
+                    logger.warning("unbound key with key code %s and mod mask %s %s", key_code, mod, "+".join(mod_desc))
 
             elif evt.type == X.KeyRelease:
                 pass
@@ -130,51 +298,194 @@ class Input:
             logger.error("an exception occurred while handling a key event")
             traceback.print_exc()
             self.ungrab_keyboard()
-            for k in self.key_bindings():
-                self.unregister_key(k)
+            self.unregister_keys(list(self.key_bindings()))
 
     def action_loop(self):
         try:
             while self.active:
-                sleep(0.01)
-                if not self.action_queue.empty():
-                    item = self.action_queue.get()
-                    item()
+                batch = [self.action_queue.get()]
+
+                # coalesce a burst of actions (e.g., caused by key autorepeat)
+                while True:
+                    try:
+                        batch.append(self.action_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = _stop_marker in batch
+                if stop:
+                    batch = batch[:batch.index(_stop_marker)]
+                if batch:
+                    self.run_batch(batch)
+                if stop:
+                    break
         except Exception as ex:
             self.stop()
             logger.error("an exception occurred while executing an action")
             traceback.print_exc()
             _exit(1)
 
+    def run_batch(self, batch):
+        """Execute actions which were queued at the same time.
+        If a batch handler is set, it is responsible for calling the actions,
+        so that it can e.g. redraw only once for the whole batch"""
+
+        self.coalesced_actions += len(batch) - 1
+        # the user might have moved the mouse since the last keystroke
+        self.invalidate_pointer()
+        if self.batch_handler:
+            self.batch_handler(batch)
+        else:
+            for item in batch:
+                item()
+
     def event_loop(self):
+        # block on the X connection instead of polling, so that key events are handled immediately
+        # and the thread does not wake up while the user is idle
         while self.active:
-            sleep(0.01)
-            if root.display.pending_events()>0:
-                evt = root.display.next_event()
+            while self.active and disp.pending_events() > 0:
+                evt = disp.next_event()
                 if evt.type in [X.KeyPress, X.KeyRelease]:
-                     self.handle_event(evt)
+                    self.handle_event(evt)
+                    continue
+
+                try:
+                    if evt.type == X.MappingNotify:
+                        self.handle_mapping_notify(evt)
+                    elif evt.type == X.PropertyNotify:
+                        self.handle_property_notify(evt)
+                except Exception as e:
+                    logger.error("an exception occurred while handling an event of type %s", evt.type)
+                    traceback.print_exc()
+
+            if not self.active:
+                break
+
+            readable, _, _ = select.select([disp, self._wakeup_r], [], [])
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 64)
+
+        os.close(self._wakeup_r)
+        with self._wakeup_lock:
+            os.close(self._wakeup_w)
+            self._wakeup_w = None
+
+    def handle_property_notify(self, evt):
+        """Forget the description of the focused window if another window gets the focus,
+        or if the focused window changes its name"""
+        if evt.atom == NET_ACTIVE_WINDOW or \
+                (evt.atom in WM_NAME_ATOMS and evt.window == self._active_window):
+            self._window_generation += 1
+            self._window = None
+
+    def handle_mapping_notify(self, evt):
+        """The keyboard mapping has changed, e.g., because of setxkbmap.
+        Resolve the keys of all bindings again"""
+        disp.refresh_keyboard_mapping(evt)
+        if evt.request == X.MappingPointer:
+            return
+        if evt.request == X.MappingKeyboard and evt.count == 1 and evt.first_keycode in keymap.remapped:
+            # caused by KeyMap.stroke, which already updated the table
+            return
+
+        logger.info("keyboard mapping changed, updating key bindings")
+        keymap.invalidate()
+
+        bindings = self.bindings
+        self.bindings = {}
+        for (key_code, mod_mask), binding in bindings.items():
+            new_code = keymap.keycode(binding.key)
+            if binding._global and new_code != (key_code, mod_mask):
+                ungrab_key(key_code, mod_mask)
+                grab_key(*new_code)
+            self.bindings[new_code] = binding
 
     def key_bindings(self):
         return dict([(b.key, b.fn) for b in self.bindings.values()])
 
-    def register_key(self, key, fn, _global=False):
-        key_code, mod_mask = get_keycode(key)
-        logger.debug("register key " + str(key) + " with keycode " + str(key_code) + " and mod mask " + str(mod_mask))
-        if _global:
-            grab_key(key_code, mod_mask)
+    def register_key(self, key, fn, _global=False, action=None, onerror=None):
+        key_code, mod_mask = keymap.keycode(key)
+        logger.debug("register key %s with keycode %s and mod mask %s", key, key_code, mod_mask)
+
+        # a global key stays grabbed if its binding is replaced
+        previous = self.bindings.get((key_code, mod_mask))
+        was_global = previous is not None and previous._global
+        if _global and not was_global:
+            grab_key(key_code, mod_mask, onerror=onerror)
 
         binding = Binding()
         binding.key = key
         binding.fn = fn
-        binding._global = _global
+        binding.action = action
+        binding._global = _global or was_global
         self.bindings[(key_code, mod_mask)] = binding
 
-    def unregister_key(self, key):
-        key_code, mod_mask = get_keycode(key)
+    def register_keys(self, bindings, _global=False):
+        """Register several keys (a mapping key -> fn) at once.
+        All grab requests are sent first, then the X server is synchronized once.
+        Returns a mapping key -> error for the keys that could not be grabbed,
+        e.g. BadAccess if another application has grabbed the key"""
+
+        if not _global:
+            for key, fn in bindings.items():
+                self.register_key(key, fn)
+            return {}
+
+        catchers = {}
+        for key, fn in bindings.items():
+            catchers[key] = Xlib.error.CatchError(Xlib.error.BadAccess)
+            self.register_key(key, fn, _global=True, onerror=catchers[key])
+
+        disp.sync()
+        self.wakeup()
+
+        errors = {}
+        for key, catcher in catchers.items():
+            if catcher.get_error():
+                errors[key] = catcher.get_error()
+                logger.warning("could not grab key %s, it is used by another application", key)
+        return errors
+
+    def unregister_keys(self, keys):
+        """Unregister several keys at once, sending all ungrab requests with a single flush"""
+
+        for key in keys:
+            self.unregister_key(key, flush=False)
+        disp.flush()
+
+    def update_bindings(self, bindings, wrap):
+        """Make 'bindings' (a mapping key -> action) the active bindings.
+        Only keys whose action has changed are registered again.
+        Keys that are not in 'bindings' are unregistered, except global keys.
+        The function 'wrap' converts an action to the function that is executed on a key press.
+        Returns the number of keys that were registered or unregistered."""
+
+        active = dict((b.key, b) for b in list(self.bindings.values()))
+        changes = 0
+
+        removed = [key for key, binding in active.items() if not binding._global and key not in bindings]
+        if removed:
+            self.unregister_keys(removed)
+            changes += len(removed)
+
+        for key, action in bindings.items():
+            binding = active.get(key)
+            if binding is not None and binding.action is not None and binding.action == action:
+                continue
+
+            self.register_key(key, wrap(action), action=action)
+            changes += 1
+
+        return changes
+
+    def unregister_key(self, key, flush=True):
+        key_code, mod_mask = keymap.keycode(key)
         try:
             binding = self.bindings[(key_code, mod_mask)]
             if binding._global:
                 ungrab_key(key_code, mod_mask)
+                if flush:
+                    disp.flush()
             del self.bindings[(key_code, mod_mask)]
         except KeyError:
             pass
@@ -183,39 +494,242 @@ class Input:
         logger.debug("grabbing keyboard")
         self.grabbing = True
         root.grab_keyboard(True, X.GrabModeAsync, X.GrabModeAsync,X.CurrentTime)
+        self.wakeup()
 
     def ungrab_keyboard(self):
         logger.debug("ungrabbing keyboard")
         self.grabbing = False
         disp.ungrab_keyboard(X.CurrentTime)
+        # the event thread does not flush the connection, and there might be no round trip soon
+        disp.flush()
         logger.debug("ungrabbing done")
 
     def stop(self):
+        self.stop_glide()
+        keymap.restore()
         if self.grabbing:
             self.ungrab_keyboard()
+        disp.flush()
         self.active = False
+        self.wakeup()
+        try:
+            self.action_queue.put_nowait(_stop_marker)
+        except queue.Full:
+            pass
+
+    def wakeup(self):
+        """Interrupt the event thread if it is waiting for X events.
+        Round trips from other threads might read pending events into the queue of the display,
+        which would not wake up the select call of the event thread"""
+        with self._wakeup_lock:
+            if self._wakeup_w is None:
+                # the event thread has exited
+                return
+            try:
+                os.write(self._wakeup_w, b"x")
+            except OSError:
+                pass
 
     def move(self, x, y):
-        #fake_input(disp, X.MotionNotify, x=int(x), y=int(y))
-        p = self.pointer()
-        x = int(x-p.x)
-        y = int(y-p.y)
-        logger.debug("moving mouse to " + str(x) + " " + str(y))
-        disp.warp_pointer(x, y)
+        """Move the pointer to the position (x, y) of the screen"""
+        logger.debug("moving mouse to %s %s", x, y)
+        self.move_along([(x, y)])
+
+    def move_along(self, positions):
+        """Move the pointer through a list of positions (x, y), all requests are sent at once"""
+        if not positions:
+            return
+
+        self.stop_glide()
+        self._warp(positions)
+
+        # we know where the pointer is now, but not which window is below it
+        x, y = positions[-1]
+        self._pointer = Coord(int(x), int(y))
+        self._pointer_window = None
+
+    def _warp(self, positions):
+        # warping relative to the root window uses absolute coordinates, so no query is needed
+        for x, y in positions:
+            root.warp_pointer(int(x), int(y))
+        disp.flush()
+
+    def glide(self, x, y, steps=10, interval=0.01):
+        """Move the pointer smoothly to the position (x, y) in several steps.
+        The steps are executed by a timer thread, so this method returns immediately."""
+
+        self.stop_glide()
+        start = self.pointer()
+        path = [(start.x + (x - start.x) * i / steps, start.y + (y - start.y) * i / steps)
+                for i in range(1, steps + 1)]
+
+        stopped = self._glide_stopped = threading.Event()
+        def run():
+            for position in path:
+                if stopped.wait(interval):
+                    return
+                with self._glide_lock:
+                    # stop_glide might have been called while waiting for the lock
+                    if stopped.is_set():
+                        return
+                    self._warp([position])
+            stopped.set()
+
+        # until the glide is finished, the pointer is reported at its destination,
+        # so that the next step does not regard the glide as a mouse movement
+        self._glide_target = Coord(int(x), int(y))
+        self._pointer = self._glide_target
+        self._pointer_window = None
+
+        threading.Thread(name='glide thread', target=run, daemon=True).start()
+
+    def stop_glide(self):
+        """Stop the current glide, if there is one"""
+        with self._glide_lock:
+            if self._glide_stopped is not None:
+                self._glide_stopped.set()
+                self._glide_stopped = None
+
+    def finish_glide(self):
+        """Move the pointer to the destination of the current glide immediately"""
+        stopped = self._glide_stopped
+        if stopped is not None and not stopped.is_set():
+            self.move(*self._glide_target)
+
+    def query_pointer(self):
+        """Get the pointer position and the window below it with a single round trip"""
+        reply = root.query_pointer()
+        self.wakeup()
+
+        self._pointer = Coord(reply.root_x, reply.root_y)
+        self._pointer_window = reply.child or root
+
+    def invalidate_pointer(self):
+        """Forget the cached pointer position, it is queried again when it is needed"""
+        stopped = self._glide_stopped
+        self._pointer = None if stopped is None or stopped.is_set() else self._glide_target
+        self._pointer_window = None
 
     def pointer(self):
-        x = root.query_pointer().win_x
-        y = root.query_pointer().win_y
-
-        return Coord(x, y)
+        """Position of the pointer. It is cached until the next keystroke (see run_batch)"""
+        if self._pointer is None:
+            self.query_pointer()
+        return self._pointer
 
     def window(self):
-        win = root.query_pointer().child or root
-        return {"name": win.get_wm_name(), "class": win.get_wm_class()}
-
+        """Description of the focused window. It is cached until a PropertyNotify event changes it
+        (see handle_property_notify), so usually no round trip is needed."""
+        result = self._window
+        if result is not None:
+            return result
+
+        generation = self._window_generation
+        active = self.active_window()
+        if active is None:
+            # the window manager does not support _NET_ACTIVE_WINDOW, use the window below the pointer
+            if self._pointer_window is None:
+                self.query_pointer()
+            return self.describe_window(self._pointer_window)
+
+        result = self.describe_window(active)
+        # don't cache the result if the focus changed in the meantime
+        if generation == self._window_generation:
+            self._window = result
+        return result
+
+    def active_window(self):
+        """Get the window with the focus according to the window manager, or None.
+        We listen for changes of its name, but not of the previously focused window."""
+        try:
+            prop = root.get_full_property(NET_ACTIVE_WINDOW, X.AnyPropertyType)
+            if not prop or not prop.value or not prop.value[0]:
+                return None
+
+            win = disp.create_resource_object("window", prop.value[0])
+            if win != self._active_window:
+                # only listen to the focused window, otherwise every window that was focused once wakes us up
+                if self._active_window is not None and self._active_window != root:
+                    self._active_window.change_attributes(event_mask=X.NoEventMask, onerror=Xlib.error.CatchError(Xlib.error.BadWindow))
+                win.change_attributes(event_mask=X.PropertyChangeMask, onerror=Xlib.error.CatchError(Xlib.error.BadWindow))
+                self._active_window = win
+            return win
+        except Xlib.error.XError:
+            # e.g., the window was destroyed
+            return None
+        finally:
+            self.wakeup()
+
+    def describe_window(self, win):
+        try:
+            return {"name": win.get_wm_name(), "class": win.get_wm_class()}
+        except Xlib.error.XError:
+            return {"name": None, "class": None}
+        finally:
+            self.wakeup()
+
+
+    def press_key(self, key):
+        """Type a key or a key combination like 'xdotool key', e.g., "ctrl+shift+t" or "Super_L+e".
+        The keys are pressed in this order and released in reverse order."""
+        strokes = []
+        for name in key.split("+"):
+            if name in key_mods:
+                code = keymap.modifier_codes.get(key_mods[name])
+                stroke = code and (code, 0)
+            else:
+                name = key_aliases.get(name, name)
+                keysym = XK.string_to_keysym(keys_to_code.get(name, name))
+                if not keysym and len(name) == 1:
+                    keysym = char_to_keysym(name)
+                stroke = keysym and self.stroke(keysym)
+
+            if not stroke:
+                logger.warning("cannot type key %s of %s", name, key)
+                return
+            strokes.append(stroke)
+
+        self.fake_keys(strokes)
+        disp.flush()
+
+    def type_text(self, text):
+        """Type a text like 'xdotool type'. All key events are sent at once."""
+        for char in text:
+            stroke = self.stroke(char_to_keysym(char))
+            if stroke:
+                self.fake_keys([stroke])
+            else:
+                logger.warning("cannot type character %s", repr(char))
+        disp.flush()
+
+    def stroke(self, keysym):
+        """Get (key code, mod mask) which types a keysym, or None (see KeyMap.stroke)"""
+        stroke, remapped = keymap.stroke(keysym)
+        if remapped:
+            # key events must not arrive before the new mapping
+            disp.sync()
+            self.wakeup()
+        return stroke
+
+    def fake_keys(self, strokes):
+        """Press the keys of a list of (key code, mod mask) with XTest and release them in reverse order.
+        The events are not flushed."""
+        codes = []
+        for code, mask in strokes:
+            for mod_mask, mod_code in keymap.modifier_codes.items():
+                if mask & mod_mask and mod_code not in codes:
+                    codes.append(mod_code)
+            if code not in codes:
+                codes.append(code)
+
+        for code in codes:
+            fake_input(disp, X.KeyPress, code)
+        for code in reversed(codes):
+            fake_input(disp, X.KeyRelease, code)
 
     def click(self, button, actions=["press", "release"]):
         key = {1: X.Button1, 2: X.Button2, 3: X.Button3, 4: X.Button4, 5: X.Button5}[button]
+        # click at the destination of a glide
+        self.finish_glide()
 
         m = {
             "press": X.ButtonPress,
@@ -225,5 +739,6 @@ class Input:
         for act in actions:
             event = m[act]
             fake_input(disp, event, key)
+        disp.flush()
 
 
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Storage for marks and macros: a mapping condition -> key -> value.
+#
+# The file <name> contains the whole mapping as JSON (the format of earlier versions).
+# Changes are appended to the journal <name>.journal, one JSON list per line:
+#   ["set", condition, key, value] or ["del", condition, key]
+# When the journal gets long, the mapping is written to <name> and the journal is emptied.
+# Replaying a journal on top of a newer <name> gives the same result,
+# so a crash between these two steps does not lose data.
+
+import os
+import json
+import threading
+from collections import defaultdict
+
+import common
+logger = common.logger(__name__)
+
+
+class Store:
+    """Mapping condition -> key -> value, which is loaded once and saved incrementally"""
+
+    def __init__(self, path=None, compact_threshold=1000):
+        """Load the store from the file 'path'. Without path, nothing is saved."""
+        self.path = path
+        self.journal_path = path and path + ".journal"
+        self.compact_threshold = compact_threshold
+        self.lock = threading.Lock()
+
+        self.data = defaultdict(dict)
+        # see lookup: matcher for the conditions and the merged mappings for each text
+        self.conditions = None
+        self.matcher = None
+        self.lookups = {}
+        self.journal_entries = 0
+        self.journal = None
+
+        if path:
+            self.load()
+
+    def load(self):
+        """Read the mapping and replay the journal"""
+        try:
+            with open(self.path, "r") as store_file:
+                for cond, bindings in json.loads(store_file.read()).items():
+                    self.data[cond].update(bindings)
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(self.journal_path, "r") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # incomplete line, e.g., the application was killed while writing it
+                        logger.warning("ignoring invalid entry in %s: %s", self.journal_path, line)
+                        continue
+                    self._apply(entry)
+                    self.journal_entries += 1
+        except FileNotFoundError:
+            pass
+
+        if self.journal_entries > self.compact_threshold:
+            self.compact()
+
+    def _apply(self, entry):
+        self.lookups = {}
+        if entry[1] not in self.data:
+            self.matcher = None
+
+        if entry[0] == "set":
+            self.data[entry[1]][entry[2]] = entry[3]
+        elif entry[0] == "del":
+            self.data[entry[1]].pop(entry[2], None)
+            if not self.data[entry[1]]:
+                del self.data[entry[1]]
+                self.matcher = None
+
+    def set(self, cond, key, value):
+        """Store a value for the key under a condition"""
+        self._change(["set", cond, key, value])
+
+    def delete(self, cond, key):
+        """Remove the value of the key under a condition"""
+        self._change(["del", cond, key])
+
+    def get(self, cond, key, default=None):
+        return self.data.get(cond, {}).get(key, default)
+
+    def size(self):
+        """Number of stored values"""
+        return sum(len(bindings) for bindings in self.data.values())
+
+    def items(self):
+        """Pairs of (condition, mapping key -> value)"""
+        return self.data.items()
+
+    def lookup(self, text, max_cached=256):
+        """Merge the mappings of all conditions that occur in the text (case insensitive).
+        The empty condition always matches. Later conditions overwrite the keys of earlier ones.
+        The result is cached until the store changes, so it must not be modified."""
+
+        text = text.lower()
+        lookups = self.lookups
+        try:
+            return lookups[text]
+        except KeyError:
+            pass
+
+        matcher = self.matcher
+        if matcher is None:
+            self.conditions = list(self.data)
+            matcher = self.matcher = common.AhoCorasick([cond.lower() for cond in self.conditions])
+        conditions = self.conditions
+
+        result = {}
+        for idx in sorted(matcher.matches(text)):
+            result.update(self.data.get(conditions[idx], {}))
+
+        if len(lookups) >= max_cached:
+            lookups.clear()
+        lookups[text] = result
+        return result
+
+    def _change(self, entry):
+        with self.lock:
+            self._apply(entry)
+            if not self.path:
+                return
+
+            if self.journal is None:
+                self.journal = open(self.journal_path, "a")
+                # terminate an incomplete last line, so that it does not corrupt the next entry
+                if self.journal.tell() > 0:
+                    with open(self.journal_path, "rb") as journal_file:
+                        journal_file.seek(-1, os.SEEK_END)
+                        if journal_file.read(1) != b"\n":
+                            self.journal.write("\n")
+            # a single write per entry, so that an interrupted write only damages the last line
+            self.journal.write(json.dumps(entry) + "\n")
+            self.journal.flush()
+            self.journal_entries += 1
+
+            # rewriting the file costs as much as the entries appended since the last time
+            if self.journal_entries > self.compact_threshold and self.journal_entries > self.size():
+                self._compact()
+
+    def compact(self):
+        """Write the whole mapping to the file and empty the journal"""
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as tmp_file:
+            tmp_file.write(json.dumps(self.data, indent=4, sort_keys=True))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, self.path)
+
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_path, "w")
+        self.journal_entries = 0
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
@@ -1,17 +1,80 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import copy
 import traceback
 import threading
-from time import sleep
 from subprocess import call
+from collections import OrderedDict, deque
+
+class TextMetrics:
+    """Least recently used cache for the size of texts, keyed by (font, text).
+    It is shared by the user interfaces, so that texts are not laid out again on every redraw."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, font, text, measure):
+        """Get the metrics of a text. On a cache miss, they are obtained by calling measure(text)"""
+        key = (font, text)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        value = measure(text)
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+text_metrics = TextMetrics()
+
+
+# unused actions of each class, see Action.acquire
+# first in, first out: the actions are acquired in the order in which they were drawn before,
+# so that e.g. the label of a cell is reused for the same cell (and keeps its text and Gtk widget)
+_pools = {}
 
 class Action:
+    # 'pooled' is only set for actions created by acquire
+    __slots__ = ("pooled",)
+
     def draw(self):
         print("WARNING: drawing action not implemented")
         pass
 
+    @classmethod
+    def acquire(cls):
+        """Get an action of this class with default values.
+        It is recycled after it is removed from the user interface (undraw/clear),
+        so the caller must not keep a reference to it afterwards."""
+
+        try:
+            action = _pools[cls].popleft()
+            action.__init__()
+        except (KeyError, IndexError):
+            action = cls()
+        action.pooled = True
+        return action
+
+    def release(self):
+        """Return an action created by acquire to the pool of its class"""
+
+        if getattr(self, "pooled", False):
+            self.pooled = False
+            _pools.setdefault(self.__class__, deque()).append(self)
+
 class Point:
     def __init__(self, x=0, y=0):
         self.x = x
@@ -21,6 +84,8 @@ class Point:
         return "x:" + str(self.x) + " y:" + str(self.y)
 
 class Rectangle(Action):
+    __slots__ = ("x", "y", "w", "h")
+
     def __init__(self, x=0, y=0, w=100, h=100):
         self.x = x
         self.y = y
@@ -28,6 +93,8 @@ class Rectangle(Action):
         self.h = h
 
 class Line(Action):
+    __slots__ = ("x1", "y1", "x2", "y2")
+
     def __init__(self):
         self.x1 = 0
         self.y1 = 0
@@ -38,6 +105,8 @@ class Line(Action):
         return "line: " + str(self.x1) + "," + str(self.y1) + " - " + str(self.x2) + "," + str(self.y2)
 
 class Label(Action):
+    __slots__ = ("x", "y", "anchor_x", "anchor_y", "text", "padding")
+
     def __init__(self):
         self.x = 0
         self.y = 0
@@ -51,6 +120,8 @@ class Label(Action):
         return (0, 0)
 
 class Zone(Action):
+    __slots__ = ("x", "y", "w", "h")
+
     def __init__(self, zone=None):
         if not zone:
             self.x = 0
@@ -79,59 +150,15 @@ class Zone(Action):
         return self.y+self.h/2
 
     def copy(self):
-        return copy.deepcopy(self)
-
-
-class RepeatingThread:
-    """Execute several functions periodically. Every function can have a different cycle"""
-
-    def __init__(self, fn_to_freq = {}, rate=1/25):
-        self.rate = rate
-        self.fn_to_freq = fn_to_freq
-
-        self.event = threading.Event()
-        self.thread = threading.Thread(name='update',
-                         target=self._run,
-                         args=(self.event,))
-        self.thread.start()
-        self.active = False
-        self.shutdown = False
-
-    def _run(self, e):
-        while True:
-            event_is_set = e.wait()
-            print("thread: " + str(self.active))
-            if self.shutdown:
-                break
-
-            cnt = 0
-            while self.active:
-                sleep(self.rate)
-                cnt += 1
-                for fn, freq in self.fn_to_freq.items():
-                    if cnt % freq == 0: fn()
-
-            e.clear()
-
-    def enable(self):
-        if not self.active:
-            self.active = True
-            self.event.set()
-
-    def disable(self):
-        self.active = False
-
-    def stop(self):
-        self.shutdown = True
-        self.activate = False
-        self.event.set()
-
-
+        return self.__class__(self)
 
 
 class UserInterface:
     def __init__(self):
         self.actions = {}
+        # actions that were removed, but might still be drawn by the current frame (see frame_actions)
+        self.removed = []
+        self.actions_lock = threading.Lock()
 
     def refresh(self):
         pass
@@ -153,16 +180,35 @@ class UserInterface:
         pass
 
     def clear(self):
-        self.actions.clear()
+        with self.actions_lock:
+            self.removed.extend(self.actions)
+            self.actions.clear()
 
     def draw(self, action):
-        self.actions[action] = True
+        with self.actions_lock:
+            self.actions[action] = True
 
     def undraw(self, action=None):
         if not action:
-            self.actions.clear()
+            self.clear()
         else:
-            del self.actions[action]
+            with self.actions_lock:
+                del self.actions[action]
+                self.removed.append(action)
+
+    def frame_actions(self):
+        """Get the actions to draw in a frame. Must be called by the thread that draws the frames.
+        The previous frames are finished, so the actions that were removed before
+        are not used anymore and can be recycled (see Action.acquire)."""
+        with self.actions_lock:
+            actions = list(self.actions)
+            removed = self.removed
+            self.removed = []
+
+        for action in removed:
+            if action not in actions:
+                action.release()
+        return actions
 
 
 if __name__ == '__main__':
@@ -24,6 +24,8 @@ import ui as base
 Action = base.Action
 
 class Rectangle(base.Rectangle):
+    __slots__ = ()
+
     def region(self):
         return cairo.RectangleInt(x=int(self.x), y=int(self.y), width=int(self.w), height=int(self.h))
 
@@ -31,6 +33,8 @@ class Rectangle(base.Rectangle):
         pass
 
 class Line(base.Line):
+    __slots__ = ()
+
     def region(self):
         w = int(abs(self.x2-self.x1))
         h = int(abs(self.y2-self.y1))
@@ -43,13 +47,15 @@ class Line(base.Line):
         pass
 
 class Label(base.Label):
+    __slots__ = ("_text", "width", "height")
+
     lock = threading.RLock()
     layout_lbl = Gtk.Label()
     layout = layout_lbl.get_layout()
-    fd = Pango.FontDescription("Serif 17")
+    font = "Serif 17"
+    fd = Pango.FontDescription(font)
 
     def __init__(self):
-        self.lbl = Gtk.Label()
         self._text = "_label_"
         super().__init__()
 
@@ -66,25 +72,24 @@ class Label(base.Label):
     def text(self):
         return self._text
 
-    def init(self):
-        self.lbl.set_text(self.text)
-        self.lbl.modify_font(self.fd)
-        self.lbl.modify_fg(Gtk.StateFlags.NORMAL,Gdk.color_parse("white"))
-
     def size(self, ui=None, changed=False):
         # workaround: calling get_layout too often causes a segmentation fault
         if hasattr(self, "width") and not changed:
             return self.width, self.height
 
-        self.lock.acquire()
+        self.width, self.height = base.text_metrics.get(self.font, self.text, self._measure)
+        return self.width, self.height
+
+    @classmethod
+    def _measure(cls, text):
+        cls.lock.acquire()
         try:
             # https://stackoverflow.com/a/23187879/1562506
-            self.layout.set_markup(self.text)
-            self.layout.set_font_description(self.fd)
-            self.width, self.height = self.layout.get_pixel_size()
-            return self.width, self.height
+            cls.layout.set_markup(text)
+            cls.layout.set_font_description(cls.fd)
+            return tuple(cls.layout.get_pixel_size())
         finally:
-            self.lock.release()
+            cls.lock.release()
 
     def region(self):
         w,h = self.size()
@@ -102,13 +107,14 @@ class Label(base.Label):
 
 
     def draw(self, ui):
-        self.init()
         left, top = self._pos()
-        ui.fix.put(self.lbl, left, top)
+        ui.place_label(self, left, top)
 
 
 
 class Zone(base.Zone):
+    __slots__ = ()
+
     def region(self):
         # TODO
         x1 = int(self.left())
@@ -150,48 +156,123 @@ class Window(Gtk.Window):
         self.ui.fix = Gtk.Fixed()
         self.add(self.ui.fix)
 
+        self.set_app_paintable(True)
+        self.set_type_hint(Gdk.WindowTypeHint.DOCK)
+        self.set_keep_below(True)
 
-        self.show_all()
+        # (width, height) of the screen when the window was resized the last time
+        self.geometry = None
 
-    def show_all(self):
-        self.resize(self.screen.get_width(), self.screen.get_height())
-        self.move(0,0)
+        # shape of the window: the union of the regions of all actions, and the region of each action
+        self.mask = cairo.Region()
+        self.sub_regions = {}
 
-        self.region = self.get_mask()
-        self.shape_combine_region(self.region)
+        # the cut out around the pointer is updated at most once per frame
+        self.frame_interval = self.get_frame_interval()
+        self.pointer = None
+        self.pointer_update_pending = False
 
-        self.set_app_paintable(True)
-        self.set_type_hint(Gdk.WindowTypeHint.DOCK)
-        self.set_keep_below(True)
-        self.present()
-        super().show_all()
+        self.apply_mask()
+        self.ui.fix.show()
+        self.show_overlay()
 
-    def get_mask(self):
-        w, h = self.get_size()
-        region = cairo.Region(cairo.RectangleInt(width=0, height=0))
+    def show_overlay(self):
+        """Show the window on the whole screen.
+        The window is only resized if the size of the screen has changed"""
 
-        for i in list(self.ui.actions.keys()):
-            r = i.region()
-            if r:
-                region.union(r)
-            else:
-                logger.warning("warning: no region for " + str(i))
+        geometry = (self.screen.get_width(), self.screen.get_height())
+        if geometry != self.geometry:
+            self.resize(*geometry)
+            self.move(0,0)
+            self.geometry = geometry
 
-        p = self.root.get_pointer()
-        self.cut_pointer(region, p.x, p.y)
-        return region
+        if not self.get_visible():
+            self.present()
+            self.show()
+
+    def get_frame_interval(self):
+        """Get the duration of a frame of the monitor in milliseconds"""
+        try:
+            display = self.screen.get_display()
+            monitor = display.get_primary_monitor() or display.get_monitor(0)
+            rate = monitor.get_refresh_rate() # in milli-Hertz
+        except AttributeError:
+            # Gtk < 3.22
+            rate = 0
+        if rate <= 0:
+            rate = 60000
+        return max(1, int(1000000 / rate))
+
+    def update_mask(self, actions):
+        """Update the union of the regions of the actions.
+        If only a few actions are new, removed or changed, only their regions are added or subtracted.
+        Otherwise (e.g., the zone changed in grid mode), the mask is built again."""
+
+        removed = []
+        added = []
+        for action in actions:
+            region = action.region()
+            if not region:
+                logger.warning("no region for %s", action)
+                continue
+            if isinstance(region, cairo.RectangleInt):
+                region = cairo.Region(region)
+
+            previous = self.sub_regions.get(action)
+            if previous is None or previous != region:
+                if previous is not None:
+                    removed.append(previous)
+                added.append(region)
+                self.sub_regions[action] = region
+
+        for action in [a for a in self.sub_regions if a not in actions]:
+            removed.append(self.sub_regions.pop(action))
+
+        # subtracting a region checks all other regions, so for many changes a rebuild is cheaper
+        if len(removed) * 4 > len(self.sub_regions):
+            self.mask = cairo.Region()
+            for region in self.sub_regions.values():
+                self.mask.union(region)
+            return
+
+        for region in removed:
+            self.mask.subtract(region)
+            # restore the parts of the other regions which overlapped the removed region
+            extents = region.get_extents()
+            for other in self.sub_regions.values():
+                if other.contains_rectangle(extents) != cairo.REGION_OVERLAP_OUT:
+                    self.mask.union(other)
+
+        for region in added:
+            self.mask.union(region)
+
+    def apply_mask(self):
+        """Set the shape of the window to the mask without the pixels around the pointer"""
+
+        region = self.mask.copy()
+        if self.pointer:
+            x, y = self.pointer
+        else:
+            p = self.root.get_pointer()
+            x, y = p.x, p.y
+        self.cut_pointer(region, x, y)
+        self.shape_combine_region(region)
 
     def redraw(self):
-        for c in self.ui.fix.get_children():
-            self.ui.fix.remove(c)
+        acts = self.ui.frame_actions()
+
+        # the widgets of actions that are not drawn anymore can be reused for the new actions
+        self.ui.release_widgets(set(acts))
 
-        acts = list(self.ui.actions.keys())
         for i in acts:
             i.draw(self.ui)
 
-        self.region = self.get_mask()
-        self.shape_combine_region(self.region)
-        self.show_all()
+        self.ui.hide_unused_widgets()
+
+        self.update_mask(set(acts))
+        self.pointer = None
+        self.apply_mask()
+        self.show_overlay()
 
 
     def undraw(self):
@@ -211,10 +292,16 @@ class Window(Gtk.Window):
 
     def on_mouse_move(self, widget, cr):
         if hasattr(cr, "x"):
-            # remove point
-            region = self.region.copy()
-            self.cut_pointer(region, cr.x, cr.y)
-            self.shape_combine_region(region)
+            # remove point, at most once per frame
+            self.pointer = (cr.x, cr.y)
+            if not self.pointer_update_pending:
+                self.pointer_update_pending = True
+                GLib.timeout_add(self.frame_interval, self.on_pointer_update)
+
+    def on_pointer_update(self):
+        self.pointer_update_pending = False
+        self.apply_mask()
+        return False
 
 
 
@@ -222,6 +309,11 @@ class UserInterface(base.UserInterface):
     def __init__(self):
         super().__init__()
 
+        # retained scene: action -> (widget, left, top, text) of the last frame
+        self.widgets = {}
+        # label widgets that are not used by an action
+        self.label_pool = []
+
         # https://stackoverflow.com/questions/21150914/python-gtk-3-safe-threading
         GObject.threads_init()
         gtk_thread = threading.Thread(name='update',
@@ -234,20 +326,67 @@ class UserInterface(base.UserInterface):
         self.enabled = False
 
         # avoid error on ctrl+c
+        # (yakm loads the user interface on the action thread, where signal handlers cannot be set;
+        # then yakm.py sets this handler at startup)
         import signal
-        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
 
         gtk_thread.start()
 
     def _run_gtk(self, e):
         Gtk.main()
 
+    def place_label(self, label, left, top):
+        """Show a widget for the label at the given position.
+        Only the changes to the previous frame are applied to the widget.
+        Must be called in the Gtk thread."""
+
+        text = label.text
+        entry = self.widgets.get(label)
+        if entry is None:
+            if self.label_pool:
+                widget = self.label_pool.pop()
+                widget.set_text(text)
+                self.fix.move(widget, left, top)
+            else:
+                widget = Gtk.Label()
+                widget.set_text(text)
+                widget.modify_font(Label.fd)
+                widget.modify_fg(Gtk.StateFlags.NORMAL,Gdk.color_parse("white"))
+                self.fix.put(widget, left, top)
+            widget.show()
+        else:
+            widget, prev_left, prev_top, prev_text = entry
+            if (left, top) != (prev_left, prev_top):
+                self.fix.move(widget, left, top)
+            if text != prev_text:
+                widget.set_text(text)
+
+        self.widgets[label] = (widget, left, top, text)
+
+    def release_widgets(self, actions):
+        """Put the widgets of all actions that are not in 'actions' into the pool"""
+
+        for action in [a for a in self.widgets if a not in actions]:
+            self.label_pool.append(self.widgets.pop(action)[0])
+
+    def hide_unused_widgets(self):
+        """Hide the widgets of the pool"""
+
+        for widget in self.label_pool:
+            if widget.get_visible():
+                widget.hide()
+
     def refresh(self):
         GLib.idle_add(self.window.redraw)
 
-    def undraw(self):
-        self.actions.clear()
-        GLib.idle_add(self.window.undraw)
+    def undraw(self, action=None):
+        super().undraw(action)
+        if action is None:
+            GLib.idle_add(self.window.undraw)
+        else:
+            self.refresh()
 
     def enable(self):
         GLib.idle_add(self.window.redraw)
@@ -318,8 +457,10 @@ def sigabrt_handler():
     logger.error("SIGABRT received")
     pass
 
-signal.signal(signal.SIGABRT, sigabrt_handler)
-logger.debug("registered SIGABRT handler")
+# signal handlers can only be set by the main thread
+if threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGABRT, sigabrt_handler)
+    logger.debug("registered SIGABRT handler")
 
 if __name__ == '__main__':
     ui = UserInterface()
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+# The user interface draws on an override-redirect window that covers the whole screen.
+# Its shape (XShape extension) only contains the pixels of the lines and labels,
+# and it does not receive any input, so that clicks go to the windows below.
+
+import os
+import select
 import traceback
 import threading
-from time import sleep
-from subprocess import call
 
 from Xlib import X, display, Xutil
+from Xlib.ext import shape
 import Xlib as xlib
 
 import common
@@ -15,26 +20,97 @@ logger = common.logger(__name__)
 import ui as base
 Action = base.Action
 
+def outline(x, y, w, h, line_width):
+    """Rectangles covering the border of a rectangle drawn with a line width"""
+    d = line_width // 2
+    return [
+        (x - d, y - d, w + line_width, line_width),
+        (x - d, y + h - d, w + line_width, line_width),
+        (x - d, y - d, line_width, h + line_width),
+        (x + w - d, y - d, line_width, h + line_width),
+    ]
+
+class Frame:
+    """Collects the primitives of a frame, so that they can be sent with a few requests:
+    one PolySegment, one PolyRectangle, one PolyFillRectangle, and one PolyText8 per text baseline"""
+
+    def __init__(self):
+        self.segments = []
+        self.rectangles = []
+        self.fills = []
+        self.texts = {} # baseline -> [(x, text), ...]
+
+    def text(self, x, y, text):
+        self.texts.setdefault(y, []).append((x, text))
+
+    def submit(self, ui):
+        window = ui.window
+        if self.segments:
+            window.poly_segment(ui.gc, self.segments)
+        if self.rectangles:
+            window.poly_rectangle(ui.gc, self.rectangles)
+        if self.fills:
+            window.poly_fill_rectangle(ui.fill_gc, self.fills)
+
+        for y, texts in self.texts.items():
+            texts.sort()
+            window.poly_text(ui.gc, texts[0][0], y, self._text_items(ui, texts))
+
+    def _text_items(self, ui, texts):
+        """Convert (x, text) pairs on the same baseline into PolyText8 items (delta, string).
+        After a string is drawn, the position advances by the width of the string"""
+        items = []
+        pos = texts[0][0]
+        for x, text in texts:
+            # deltas are 8 bit signed integers
+            delta = x - pos
+            while delta > 127:
+                items.append((127, b""))
+                delta -= 127
+            while delta < -128:
+                items.append((-128, b""))
+                delta += 128
+
+            items.append((delta, text.encode()))
+            pos = x + ui.text_extents(ui.gc, text)["overall_width"]
+        return items
+
 class Rectangle(base.Rectangle):
+    __slots__ = ()
+
+    def shape(self, ui):
+        return outline(int(self.x), int(self.y), int(self.w), int(self.h), ui.line_width)
+
     def draw(self, ui):
-        ui.window.rectangle(ui.gc,
+        ui.frame.rectangles.append((
             int(self.x),
             int(self.y),
             int(self.w),
             int(self.h)
-        )
+        ))
 
 class Line(base.Line):
+    __slots__ = ()
+
+    def _coords(self):
+        # TODO: intersection with border
+        return (max(0,int(self.x1)),
+                max(0,int(self.y1)),
+                max(0,int(self.x2)),
+                max(0,int(self.y2)))
+
+    def shape(self, ui):
+        x1, y1, x2, y2 = self._coords()
+        d = ui.line_width // 2
+        return [(min(x1, x2) - d, min(y1, y2) - d,
+                 abs(x2 - x1) + ui.line_width, abs(y2 - y1) + ui.line_width)]
+
     def draw(self, ui):
-        ui.window.line(ui.gc,
-            # TODO: intersection with border
-            max(0,int(self.x1)),
-            max(0,int(self.y1)),
-            max(0,int(self.x2)),
-            max(0,int(self.y2))
-        )
+        ui.frame.segments.append(self._coords())
 
 class Label(base.Label):
+    __slots__ = ("width", "height", "shift_y")
+
     def size(self, ui):
         info = ui.text_extents(ui.gc, self.text)
         self.width = info["overall_width"] + 2 * self.padding
@@ -42,124 +118,272 @@ class Label(base.Label):
         self.shift_y = info["font_ascent"]
         return (self.width, self.height)
 
-    def draw(self, ui):
+    def _pos(self, ui):
         self.size(ui)
         # coordinates are bottom left corner of text
         left = self.x - self.anchor_x * self.width
         top = self.y - self.anchor_y * self.height
+        return int(left), int(top)
 
-        ui.window.fill_rectangle(ui.fill_gc,
-            int(left),
-            int(top),
+    def shape(self, ui):
+        left, top = self._pos(ui)
+        return [(left, top, int(self.width), int(self.height))]
+
+    def draw(self, ui):
+        left, top = self._pos(ui)
+
+        ui.frame.fills.append((
+            left,
+            top,
             int(self.width),
             int(self.height)
-        )
+        ))
 
-        ui.window.draw_text(ui.gc,
-                int(left + self.padding),
-                int(top + self.shift_y + self.padding),
-                self.text.encode()
+        ui.frame.text(
+                left + self.padding,
+                top + self.shift_y + self.padding,
+                self.text
         )
 
 
 
 class Zone(base.Zone):
+    __slots__ = ()
+
+    def shape(self, ui):
+        return outline(int(self.x-self.w/2), int(self.y-self.h/2), int(self.w), int(self.h), ui.line_width)
+
     def draw(self, ui):
-        ui.window.rectangle(ui.gc,
+        ui.frame.rectangles.append((
             int(self.x-self.w/2),
             int(self.y-self.h/2),
             int(self.w),
             int(self.h)
-        )
+        ))
 
 class UserInterface(base.UserInterface):
     def __init__(self):
         self.d = display.Display()
-        font = self.d.open_font("-adobe-helvetica-*-r-normal-*-25-*-*-*-*-*-*-*")
+        self.font_name = "-adobe-helvetica-*-r-normal-*-25-*-*-*-*-*-*-*"
+        font = self.d.open_font(self.font_name)
         if font == None:
-            font = self.d.open_font("-*-*-bold-r-normal--25-*-*-75-*-*-*-*")
-
-        self.screen = self.d.screen()
-        self.window = self.screen.root
+            self.font_name = "-*-*-bold-r-normal--25-*-*-75-*-*-*-*"
+            font = self.d.open_font(self.font_name)
 
+        if not self.d.has_extension("SHAPE"):
+            logger.error("the X server does not support the SHAPE extension, the overlay will cover the screen")
 
-        fg = 0xff0000
-        bg = 0x00ff00
+        self.screen = self.d.screen()
+        self.root = self.screen.root
+        self.window = self.create_overlay()
 
+        self.line_width = 2
         self.gc = self.window.create_gc(
-            line_width = 2,
-            foreground = fg,
-            background = bg,
-            subwindow_mode = X.IncludeInferiors,
+            line_width = self.line_width,
+            foreground = self.pixel(0xff0000),
+            background = self.pixel(0x00ff00),
             font = font,
         )
 
         self.fill_gc = self.window.create_gc(
             line_width = 4,
-            foreground = 0xffffff,
-            background = 0xffffff,
-            subwindow_mode = X.IncludeInferiors,
+            foreground = self.pixel(0xffffff),
+            background = self.pixel(0xffffff),
             font = font,
         )
 
         super().__init__()
+        self.frame = Frame()
+
+        # the render thread only draws if something has changed
+        self.enabled = False
+        self.mapped = False
+        self.shutdown = False
+        self.lock = threading.Lock()
+        self.redraw_pending = False
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        # the write end is closed by the render thread when it exits, see wakeup()
+        self._wakeup_lock = threading.Lock()
+        self.thread = threading.Thread(name='update', target=self._run)
+        self.thread.start()
+
+    def create_overlay(self):
+        """Create the overlay window, using a visual with alpha channel if available"""
+
+        self.argb = False
+        depth = self.screen.root_depth
+        visual = X.CopyFromParent
+        attributes = {}
+        for d in self.screen.allowed_depths:
+            if d.depth != 32:
+                continue
+            for v in d.visuals:
+                if v.visual_class == X.TrueColor:
+                    self.argb = True
+                    depth = 32
+                    visual = v.visual_id
+                    # a window with a different depth than its parent needs its own colormap and border
+                    attributes["colormap"] = self.root.create_colormap(visual, X.AllocNone)
+                    attributes["border_pixel"] = 0
+                    break
+            if self.argb:
+                break
+
+        geo = self.root.get_geometry()
+        window = self.root.create_window(
+            0, 0, geo.width, geo.height, 0, depth,
+            X.InputOutput, visual,
+            override_redirect = True,
+            background_pixel = self.pixel(0xff0000),
+            event_mask = X.ExposureMask,
+            **attributes
+        )
+
+        if self.d.has_extension("SHAPE"):
+            # nothing is shown until the first redraw, and clicks always pass through the window
+            window.shape_rectangles(shape.SO.Set, shape.SK.Bounding, X.Unsorted, 0, 0, [])
+            window.shape_rectangles(shape.SO.Set, shape.SK.Input, X.Unsorted, 0, 0, [])
+        return window
+
+    def pixel(self, rgb):
+        """Get the pixel value of an opaque color"""
+        if self.argb:
+            return 0xff000000 | rgb
+        return rgb
 
-        fn_to_freq = {}
-        fn_to_freq[lambda: self.refresh()] = 50
+    def _run(self):
+        while not self.shutdown:
+            readable, _, _ = select.select([self.d, self._wakeup_r], [], [])
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 64)
+
+            redraw = False
+            while self.d.pending_events() > 0:
+                if self.d.next_event().type == X.Expose:
+                    redraw = True
+
+            with self.lock:
+                redraw = redraw or self.redraw_pending
+                self.redraw_pending = False
+
+            if not redraw:
+                continue
 
-        def fn():
             try:
                 self.redraw()
             except Exception as e:
                 traceback.print_exc()
                 print(e)
-                return
-        fn_to_freq[fn] = 1
 
-        self.thread = base.RepeatingThread(fn_to_freq)
+        # closing the display also destroys the overlay window
+        self.d.close()
+        os.close(self._wakeup_r)
+        with self._wakeup_lock:
+            os.close(self._wakeup_w)
+            self._wakeup_w = None
+
+    def wakeup(self):
+        """Wake up the render thread.
+        Also needed after round trips from other threads, as they might have read our events"""
+        with self._wakeup_lock:
+            if self._wakeup_w is None:
+                # the render thread has exited
+                return
+            try:
+                os.write(self._wakeup_w, b"x")
+            except OSError:
+                pass
 
+    def request(self):
+        """Ask the render thread to draw the actions"""
+        with self.lock:
+            self.redraw_pending = True
+        self.wakeup()
 
     def text_extents(self, gc, text):
-        if not hasattr(gc, "_extent_cache"): setattr(gc, "_extent_cache", {})
-        cache = getattr(gc, "_extent_cache")
+        return base.text_metrics.get(self.font_name, text, self._query_text_extents)
 
-        if text in cache: return cache[text]
+    def _query_text_extents(self, text):
         info = self.gc.query_text_extents(text.encode())._data
-        cache[text] = info
+        self.wakeup()
         return info
 
     def mouse_coords(self):
-        data = self.window.query_pointer()._data
+        data = self.root.query_pointer()._data
+        self.wakeup()
         return Point(x=data["root_x"], y=data["root_y"])
 
+    def draw(self, action):
+        super().draw(action)
+        self.request()
+
+    def undraw(self, action=None):
+        super().undraw(action)
+        self.request()
+
+    def clear(self):
+        super().clear()
+        self.request()
+
     def enable(self):
-        self.thread.enable()
+        self.enabled = True
+        self.request()
 
     def disable(self):
-        self.thread.disable()
-        self.refresh()
+        self.enabled = False
+        self.request()
 
     def is_enabled(self):
-        return self.thread.active
+        return self.enabled
 
     def stop(self):
-        self.thread.stop()
+        self.shutdown = True
+        self.wakeup()
 
     def refresh(self):
-        # TODO: do this with xlib
-        call(["xrefresh"])
-        pass
+        self.request()
 
     def redraw(self):
-        for a in list(self.actions.keys()):
+        """Update the shape of the overlay and draw the actions.
+        Drawings persist, so this is only necessary if the actions change or the window is exposed"""
+
+        actions = self.frame_actions()
+        if not self.enabled or not actions:
+            if self.mapped:
+                self.window.unmap()
+                self.mapped = False
+                self.d.flush()
+            return
+
+        rectangles = []
+        for a in actions:
+            rectangles += a.shape(self)
+        rectangles = [(x, y, max(0, w), max(0, h)) for x, y, w, h in rectangles]
+        self.window.shape_rectangles(shape.SO.Set, shape.SK.Bounding, X.Unsorted, 0, 0, rectangles)
+
+        if not self.mapped:
+            self.window.map()
+            self.window.configure(stack_mode = X.Above)
+            self.mapped = True
+
+        # collect the primitives of all actions and send them together
+        self.frame = Frame()
+        for a in actions:
             a.draw(self)
+        self.frame.submit(self)
         self.d.flush()
 
     def screen_width(self):
-        return self.window.get_geometry().width
+        width = self.root.get_geometry().width
+        self.wakeup()
+        return width
 
     def screen_height(self):
-        return self.window.get_geometry().height
+        height = self.root.get_geometry().height
+        self.wakeup()
+        return height
 
 
 try:
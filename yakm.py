@@ -10,29 +10,60 @@ You can find more information in the readme.
 # standard imports
 import copy
 import string
-import json
 import fcntl
 from sys import exit
 import subprocess
 import os
 import time
+import threading
+import signal
+import functools
+import hashlib
+import marshal
+import importlib.util
 
 import pathlib
 import os.path
-from collections import defaultdict
-
-try:
-    import ui_gtk as ui
-except Exception as exception:
-    print(exception)
-    print("WARNING: GTK not available, trying Xlib user interface")
-
-    import ui_xlib as ui
+from collections import deque, namedtuple
 
 import input_devices
+import store
 from common import *
 logger = logger("yakm")
 
+# directory for the marks, macros, and cached code, set at startup
+conf_dir = None
+
+# stores of the config dir, see open_store
+stores = {}
+
+def open_store(name):
+    """Get a store of the config dir (e.g., "marks" or "macros"), it is loaded on first use"""
+    try:
+        return stores[name]
+    except KeyError:
+        pass
+
+    result = store.Store(conf_dir and os.path.join(conf_dir, name))
+    return stores.setdefault(name, result)
+
+# the user interface backend module, imported by load_ui when the navigation starts
+ui = None
+
+def load_ui():
+    """Import the user interface backend: Gtk if available, Xlib otherwise"""
+    global ui
+    if ui is None:
+        try:
+            import ui_gtk as backend
+        except Exception as exception:
+            print(exception)
+            print("WARNING: GTK not available, trying Xlib user interface")
+
+            import ui_xlib as backend
+        ui = backend
+    return ui
+
 
 
 
@@ -44,9 +75,14 @@ with command_definitions(lambda: globals()):
 
     def warp(state):
         """Move the mouse to the middle of the zone"""
-        logger.debug("moving mouse to " + str(state.zone.x) + " " + str(state.zone.y))
+        logger.debug("moving mouse to %s %s", state.zone.x, state.zone.y)
         state.nav.move(state.zone.x, state.zone.y)
 
+    def glide(state):
+        """Move the mouse smoothly to the middle of the zone"""
+        logger.debug("gliding mouse to %s %s", state.zone.x, state.zone.y)
+        state.nav.glide(state.zone.x, state.zone.y)
+
     def start(state):
         """Start the navigation. Enters the default mode if no other mode is active"""
         if not state.mode:
@@ -65,8 +101,7 @@ with command_definitions(lambda: globals()):
 
     def clear(state):
         """Clear all keybindings"""
-        for k in state.nav.key_bindings():
-            state.nav.input.unregister_key(k)
+        state.nav.input.unregister_keys(list(state.nav.key_bindings()))
 
     def sh(command, state):
         """Execute a command"""
@@ -84,11 +119,11 @@ with command_definitions(lambda: globals()):
 
     def info(state):
         """Write information about the current state to stdout"""
-        logger.debug("bindings:")
+        print("bindings:")
         for key, action in state.nav.key_bindings().items():
-            logger.debug("    key " + str(key) + " -> " + str(get_cmd(action)))
+            print("    key " + str(key) + " -> " + str(get_cmd(action)))
         win = state.nav.input.window()
-        logger.debug("focused window: " + str(win))
+        print("focused window: " + str(win))
 
     def ignore(_state):
         """This command does nothing"""
@@ -198,7 +233,7 @@ with command_definitions(lambda: globals()):
         if not type(grid_mode) == GridMode:
             return
 
-        logger.debug("selecting row " +str(row))
+        logger.debug("selecting row %s", row)
         top = state.zone.top() + row / grid_mode.grid.h  * state.zone.h
         state.zone.y = top + 0.5 * state.zone.h / grid_mode.grid.h
         state.zone.h = max(grid_mode.grid.h, state.zone.h / grid_mode.grid.h)
@@ -216,7 +251,7 @@ with command_definitions(lambda: globals()):
         if not type(grid_mode) == GridMode:
             return
 
-        logger.debug("selecting col " +str(col))
+        logger.debug("selecting col %s", col)
         left = state.zone.left() + col / grid_mode.grid.w  * state.zone.w
         state.zone.x = left + 0.5 * state.zone.w / grid_mode.grid.w
         state.zone.w = max(grid_mode.grid.w, state.zone.w / grid_mode.grid.w)
@@ -266,7 +301,7 @@ with command_definitions(lambda: globals()):
     def press_key(to_press, state):
         """Type a key or a key combination"""
 
-        subprocess.call(["xdotool", "key", str(to_press)])
+        state.nav.input.press_key(str(to_press))
 
     def record_macro(state):
         """Record a sequence of commands as a macro"""
@@ -295,14 +330,22 @@ class Size:
         return "size: " + str(self.w) + "," + str(self.h)
 
 class ScreenSize:
-    def __init__(self, ui):
-        self.ui = ui
-        self.width = ui.screen_width
-        self.height = ui.screen_height
+    def __init__(self, nav):
+        self.nav = nav
+
+    def width(self):
+        return self.nav.ui.screen_width()
+
+    def height(self):
+        return self.nav.ui.screen_height()
 
     def __str__(self):
         return "size: " + str(self.width()) + "," + str(self.height())
 
+# compact description of a state for the history, see State.snapshot
+# zone: (x, y, w, h), mode: tuple of modes, fields: tuple of (attribute, value)
+Snapshot = namedtuple("Snapshot", "zone mode fields")
+
 class State:
     """This class tracks the state of the navigation. This includes
     - the current zone: the region that the user selected
@@ -311,16 +354,19 @@ class State:
     - whether the user is dragging
     """
 
+    __slots__ = ("nav", "screen", "mode", "drag", "modifiers",
+                 "_bindings_cache")
+
     def __init__(self, nav):
         # references
         self.nav = nav
-        self.screen = ScreenSize(nav.ui)
+        self.screen = ScreenSize(nav)
 
         # state
         self.mode = []
-        self._zone = ui.Zone()
         self.drag = False
-        self._settings = {} # settings for modes
+        self.modifiers = {} # pressed modifiers (voice mode)
+        self._bindings_cache = None # (modes and their sub-states, bindings)
 
     def __str__(self):
         result = "state: " + \
@@ -341,28 +387,35 @@ class State:
         if not self.mode:
             return
 
-        logger.debug("setting zone " + str(zone))
+        logger.debug("setting zone %s", zone)
         self.mode[-1].zone = zone
 
-    def copy(self):
-        """Create a copy of this state."""
+    # attributes that are stored in a snapshot besides the zone and the modes
+    _snapshot_fields = ("drag", "modifiers")
 
-        result = State(self.nav)
-        result.screen = self.screen
-        result.mode = self.mode[:]
+    def snapshot(self):
+        """Create a snapshot of the navigation state for the history.
+        It contains the geometry of the zone, the modes and the remaining fields,
+        but not the marks and macros (see open_store)."""
 
-        exclude = set(dir(State))
-        exclude.update(["nav", "screen", "mode"])
+        zone = self.zone
+        fields = tuple((attr, copy.copy(getattr(self, attr))) for attr in self._snapshot_fields)
+        return Snapshot((zone.x, zone.y, zone.w, zone.h), tuple(self.mode), fields)
 
-        for attr in dir(self):
-            if attr in exclude:
-                continue
-            setattr(result, attr, copy.deepcopy(getattr(self, attr)))
-        return result
+    def restore(self, snapshot):
+        """Go back to the state of a snapshot"""
+
+        self.mode = list(snapshot.mode)
+        for attr, value in snapshot.fields:
+            setattr(self, attr, copy.copy(value))
+
+        zone = ui.Zone()
+        zone.x, zone.y, zone.w, zone.h = snapshot.zone
+        self.zone = zone
 
     def enter_mode(self, mode, grab_keyboard=True):
         """Enter a mode"""
-        logger.debug("entering mode " + str(mode))
+        logger.debug("entering mode %s", mode)
 
         self.nav.ui.enable()
         if grab_keyboard:
@@ -376,7 +429,7 @@ class State:
         """Leave the currently active mode"""
 
         while self.mode:
-            logger.debug("leaving mode " + str(self.mode[-1]))
+            logger.debug("leaving mode %s", self.mode[-1])
             if not self.mode[-1].exit(self, forced=all_modes):
                 return
             self.mode = self.mode[:-1]
@@ -387,11 +440,20 @@ class State:
             self.mode[-1].enter(self)
             self.nav.ui.refresh()
         else:
+            # remove the bindings of the modes
+            self.update_bindings()
             self.nav.ui.disable()
             self.nav.ui.refresh()
             self.nav.ungrab_keyboard()
 
     def get_current_bindings(self):
+        """Get the mapping from key to action for the current mode stack.
+        The result is cached until a mode is entered or left, or until the sub-state of a mode changes"""
+
+        cache_key = tuple((mode, mode.sub_state(self)) for mode in self.mode)
+        if self._bindings_cache is not None and self._bindings_cache[0] == cache_key:
+            return self._bindings_cache[1]
+
         # first, get all keys that might have a binding
         possbile_bindings = {}
         for mode in self.mode:
@@ -410,16 +472,17 @@ class State:
 
                 bindings[key] = act
 
+        self._bindings_cache = (cache_key, bindings)
         return bindings
 
     def update_bindings(self):
-        """Activate the key bindings of this mode"""
+        """Activate the key bindings of the current modes"""
 
         bindings = self.get_current_bindings()
 
-        for key, action in bindings.items():
+        def wrap(action, nav=self.nav):
             # use state of navigation, so that we can undo actions
-            def _upd(action=action, nav=self.nav):
+            def _upd(action=action, nav=nav):
                 """wrap action in a lambda function"""
 
                 # update zone if user has moved the cursor
@@ -436,12 +499,19 @@ class State:
                 # store cursor positions after our actions
                 nav.prev_pointer = nav.pointer()
 
-            _upd = annotate(_upd, get_cmd(action))
-            self.nav.input.register_key(key, _upd)
+            return annotate(_upd, get_cmd(action))
+
+        # only keys with a different action are registered again
+        self.nav.input.update_bindings(bindings, wrap)
 
     def update(self, undoable=True):
         """Update the user interface and set the right mode"""
 
+        if undoable and self.nav.deferring:
+            # executing a batch of actions, update once at the end
+            self.nav.update_pending = True
+            return
+
         if self.mode:
             self.mode[-1].apply(self)
 
@@ -451,7 +521,11 @@ class State:
             self.nav.do_step(self)
 
     def show_status(self):
-        label = ui.Label()
+        # a drawn label must not be changed (the user interface might be drawing it), so a new one is used
+        previous = self.nav.status_label
+        if previous is not None and previous in self.nav.ui.actions:
+            self.nav.undraw(previous)
+        label = self.nav.status_label = ui.Label.acquire()
         label.anchor_x = 0
         label.anchor_y = 1
         label.x = 0
@@ -460,16 +534,6 @@ class State:
         label.text = " > ".join([str(m) for m in self.mode])
         self.nav.draw(label)
 
-    def settings(self, inst, default=None):
-        """Save settings for a mode based on its class name."""
-        if default is None:
-            default = {}
-
-        name = inst.__class__.__name__
-        if not name in self._settings:
-            self._settings[name] = default
-
-        return self._settings[name]
 
 
 class Mode:
@@ -477,6 +541,9 @@ class Mode:
     The mapping is active if the mode is active.
     Modes can be nested."""
 
+    # (sub-state, bindings) of this mode, see own_bindings
+    _own_bindings = None
+
     def __init__(self, nav, conf):
         self.nav = nav
         self.conf = conf
@@ -488,6 +555,22 @@ class Mode:
     def get_zone(self):
         return self.zone
 
+    def sub_state(self, _state):
+        """Describes the state of this mode that get_bindings depends on.
+        The bindings of the mode are computed again when the sub-state changes.
+        The return value must be hashable."""
+
+        return None
+
+    def own_bindings(self, state):
+        """Get the bindings of this mode without those of the outer modes.
+        The result is cached for the current sub-state."""
+
+        sub_state = self.sub_state(state)
+        if self._own_bindings is None or self._own_bindings[0] != sub_state:
+            self._own_bindings = (sub_state, self.get_bindings(state))
+        return self._own_bindings[1]
+
     def apply(self, state):
         """Draw visualization of this mode on the screen"""
 
@@ -500,8 +583,8 @@ class Mode:
         if sub_action:
             return sub_action
 
-        bindings = self.get_bindings(_state)
-        logger.trace("keys: " + str(bindings.keys()))
+        bindings = self.own_bindings(_state)
+        logger.trace("keys: %s", bindings.keys())
         if key in bindings:
             return bindings[key]
 
@@ -531,12 +614,7 @@ class Mode:
     def exit(self, state, forced=False):
         """This method is called when the user de-activates this mode"""
 
-        # only unregister my keybindings
-        # other keybindings are restored when entering previous mode
-        for key, action in self.get_bindings(state).items():
-            if not start in action:
-                state.nav.input.unregister_key(key)
-
+        # the keybindings are updated by the state after the mode has been removed
         state.nav.undraw()
         return True
 
@@ -561,6 +639,9 @@ class GridMode(Mode):
     def __str__(self):
         return "grid " + str(self.grid_nav)
 
+    def sub_state(self, _state):
+        return self.grid_nav
+
     def get_bindings(self, state, bindings=None):
         new_bindings = {}
         if self.grid_nav == "row":
@@ -606,82 +687,106 @@ class GridMode(Mode):
         state.nav.ui.disable()
         state.update_bindings()
 
-        # draw horizontal lines
-        for grid_row, first_y, last_y in iter_first_last(range(self.grid.h+1)):
-            # avoid drawing lines in grid if grid is very small
-            horizontal_until_x = state.zone.right()
-            if state.zone.w < self.grid.w * 30 and not first_y and not last_y:
-                horizontal_until_x = state.zone.left() - 10
-
-            if first_y or last_y or self.grid_nav is None or \
-                    self.grid_nav == "row" or self.grid_nav == "dart":
-
-                line = ui.Line()
-                line.x1 = state.zone.left()
-                line.x2 = horizontal_until_x
+        zone = state.zone
+        layout = grid_layout(
+            (zone.left(), zone.top(), zone.w, zone.h),
+            (self.grid.w, self.grid.h),
+            self.grid_nav,
+            tuple(configuration["grid_nav_chars"]),
+            tuple(tuple(row) for row in configuration["dart_nav_chars"]),
+            state.nav.ui)
+
+        for x1, y1, x2, y2 in layout.lines:
+            line = ui.Line.acquire()
+            line.x1 = x1
+            line.y1 = y1
+            line.x2 = x2
+            line.y2 = y2
+            state.nav.draw(line)
+
+        for x, y, text in layout.labels:
+            label = ui.Label.acquire()
+            label.x = x
+            label.y = y
+            label.text = text
+            state.nav.draw(label)
 
-                line.y1 = state.zone.top() + grid_row * state.zone.h / self.grid.h
-                line.y2 = line.y1
-                state.nav.draw(line)
+        state.nav.ui.refresh()
+        state.nav.ui.enable()
 
-        # draw vertical lines
-        for grid_col, first_x, last_x in iter_first_last(range(self.grid.w+1)):
-            # avoid drawing lines in grid if grid is very small
-            vertical_until_y = state.zone.bottom()
-            if state.zone.h < self.grid.h * 30 and not first_x and not last_x:
-                vertical_until_y = state.zone.top() - 10
 
-            if first_x or last_x or self.grid_nav is None or \
-                    self.grid_nav == "col" or self.grid_nav == "dart":
+# lines: list of (x1, y1, x2, y2), labels: list of (x, y, text)
+GridLayout = namedtuple("GridLayout", "lines labels")
 
-                line = ui.Line()
-                line.x1 = state.zone.left() + grid_col * state.zone.w / self.grid.w
-                line.x2 = line.x1
+@functools.lru_cache(maxsize=256)
+def grid_layout(zone, grid, grid_nav, grid_nav_chars, dart_nav_chars, user_interface):
+    """Calculate the lines and labels of the grid mode.
+    zone is (left, top, width, height), grid is (columns, rows).
+    The result only depends on the arguments, so it is cached,
+    e.g., going back in the history shows a cached layout."""
 
-                line.y1 = state.zone.top()
-                line.y2 = vertical_until_y
-                state.nav.draw(line)
+    left, top, zone_w, zone_h = zone
+    grid_w, grid_h = grid
+    right = left + zone_w
+    bottom = top + zone_h
 
-        if self.grid_nav == "row":
-            delta = state.zone.h / self.grid.h
-            for grid_row in range(self.grid.h):
-                label = ui.Label()
-                label.x = state.zone.left() + 0.5 * state.zone.w / self.grid.w
-                label.y = state.zone.top() + (grid_row + 0.5) * delta
-                label.text = str(configuration["grid_nav_chars"][grid_row])
+    def label_size(text):
+        label = ui.Label.acquire()
+        label.text = text
+        size = label.size(user_interface)
+        label.release()
+        return size
 
-                if label.size(state.nav.ui)[1] > delta:
-                    break
-                state.nav.draw(label)
+    lines = []
 
-        if self.grid_nav == "col":
-            delta = state.zone.w / self.grid.w
-            for grid_col in range(self.grid.w):
-                label = ui.Label()
-                label.x = state.zone.left() + (grid_col + 0.5) * delta
-                label.y = state.zone.top() + 0.5 * state.zone.h / self.grid.h
-                label.text = str(configuration["grid_nav_chars"][grid_col])
+    # horizontal lines
+    if grid_nav is None or grid_nav == "row" or grid_nav == "dart":
+        rows = range(grid_h+1)
+    else:
+        rows = [0, grid_h]
+    # avoid drawing lines in grid if grid is very small
+    inner_until_x = right if zone_w >= grid_w * 30 else left - 10
+    lines += [(left, top + row * zone_h / grid_h,
+               right if row in (0, grid_h) else inner_until_x, top + row * zone_h / grid_h)
+              for row in rows]
+
+    # vertical lines
+    if grid_nav is None or grid_nav == "col" or grid_nav == "dart":
+        cols = range(grid_w+1)
+    else:
+        cols = [0, grid_w]
+    inner_until_y = bottom if zone_h >= grid_h * 30 else top - 10
+    lines += [(left + col * zone_w / grid_w, top,
+               left + col * zone_w / grid_w, bottom if col in (0, grid_w) else inner_until_y)
+              for col in cols]
+
+    labels = []
+    if grid_nav == "row":
+        delta = zone_h / grid_h
+        for grid_row in range(grid_h):
+            text = str(grid_nav_chars[grid_row])
+            if label_size(text)[1] > delta:
+                break
+            labels.append((left + 0.5 * zone_w / grid_w, top + (grid_row + 0.5) * delta, text))
 
-                if label.size(state.nav.ui)[0] > delta:
-                    break
-                state.nav.draw(label)
+    if grid_nav == "col":
+        delta = zone_w / grid_w
+        for grid_col in range(grid_w):
+            text = str(grid_nav_chars[grid_col])
+            if label_size(text)[0] > delta:
+                break
+            labels.append((left + (grid_col + 0.5) * delta, top + 0.5 * zone_h / grid_h, text))
 
-        if self.grid_nav == "dart":
-            delta_x = state.zone.w / self.grid.w
-            delta_y = state.zone.h / self.grid.h
-            label = ui.Label()
-            label.text = "Ig"
-            if max(label.size(state.nav.ui)) < min(delta_x, delta_y):
-                for grid_col in range(self.grid.w):
-                    for grid_row in range(self.grid.h):
-                        label = ui.Label()
-                        label.x = state.zone.left() + (grid_col + 0.5) * delta_x
-                        label.y = state.zone.top() + (grid_row + 0.5) * delta_y
-                        label.text = str(configuration["dart_nav_chars"][grid_row][grid_col])
-                        state.nav.draw(label)
+    if grid_nav == "dart":
+        delta_x = zone_w / grid_w
+        delta_y = zone_h / grid_h
+        if max(label_size("Ig")) < min(delta_x, delta_y):
+            labels += [(left + (grid_col + 0.5) * delta_x, top + (grid_row + 0.5) * delta_y,
+                        str(dart_nav_chars[grid_row][grid_col]))
+                       for grid_col in range(grid_w)
+                       for grid_row in range(grid_h)]
 
-        state.nav.ui.refresh()
-        state.nav.ui.enable()
+    return GridLayout(tuple(lines), tuple(labels))
 
 
 class KeySelectMode(Mode):
@@ -697,7 +802,7 @@ class KeySelectMode(Mode):
     def apply(self, state):
         state.nav.ui.clear()
 
-        label = ui.Label()
+        label = ui.Label.acquire()
         label.x = state.screen.width() / 2
         label.y = state.screen.height() / 2
         label.text = " press a key "
@@ -731,16 +836,8 @@ class MarkMode(Mode):
 
     def __init__(self, nav, conf, record=False):
         self.nav = nav
-        my_marks = self.marks()
         self.record = record
 
-        if not my_marks:
-            try:
-                with open(conf_dir + "marks", "r") as marks_file:
-                    my_marks.update(json.loads(marks_file.read()))
-            except FileNotFoundError:
-                pass
-
         conf = {}
         if not record:
             for key, coord in self.bindings().items():
@@ -756,8 +853,6 @@ class MarkMode(Mode):
             def register_mark(state, key):
                 """register a mark for the current pointer position"""
 
-                my_marks = self.marks()
-
                 win = self.nav.input.window()
                 msg = ("enter a filter for mark " + str(key) + "\n" +
                        "leave empty for global mark" + "\n\n" +
@@ -766,27 +861,19 @@ class MarkMode(Mode):
                 cond = self.nav.input_dialog(msg)
 
                 if cond != None:
-                    my_marks[cond][key] = (state.zone.x, state.zone.y)
+                    open_store("marks").set(cond, key, (state.zone.x, state.zone.y))
 
             self.nav.state.enter_mode(KeySelectMode(self.nav, register_mark))
 
 
 
 
-    def marks(self):
-        """mapping from condition -> key -> action"""
-        return self.nav.state.settings(self, defaultdict(lambda: dict()))
-
     def bindings(self):
         """get mapping from key -> action"""
 
-        result = {}
-        win = str(self.nav.input.window()).lower()
-        for cond, bindings in self.marks().items():
-            if not cond.lower() in str(win):
-                continue
-            result.update(bindings)
-        logger.debug(result)
+        win = str(self.nav.input.window())
+        result = open_store("marks").lookup(win)
+        logger.debug("bindings for window %s: %s", win, result)
         return result
 
     def apply(self, state):
@@ -798,14 +885,14 @@ class MarkMode(Mode):
         bindings = self.bindings()
 
         if not bindings:
-            label = ui.Label()
+            label = ui.Label.acquire()
             label.x = state.screen.width() / 2
             label.y = state.screen.height() / 2
             label.text = "no marks"
             state.nav.draw(label)
 
         for key, coord in bindings.items():
-            label = ui.Label()
+            label = ui.Label.acquire()
             label.x = coord[0]
             label.y = coord[1]
             label.text = key
@@ -814,11 +901,6 @@ class MarkMode(Mode):
         if enabled:
             state.nav.ui.enable()
 
-    def save(self, _state):
-        """save the current marks in a file in the config dir"""
-        with open(conf_dir + "marks", "w") as marks_file:
-            marks_file.write(json.dumps(self.marks(), indent=4, sort_keys=True))
-
 
 
 class MacroMode(Mode):
@@ -829,20 +911,12 @@ class MacroMode(Mode):
         self.nav = nav
         # if we are currently recording a macro, current key is the key of the macro
         self.current_key = None
-        self.my_macros = self.macros()
         self.cmd_sequence = []
         self.pos = Coord(0,0)
         self.POS = "position"
         self.CMD = "command"
         self.recording = record
 
-        if not self.my_macros:
-            try:
-                with open(conf_dir + "macros", "r") as macros_file:
-                    self.my_macros.update(json.loads(macros_file.read()))
-            except FileNotFoundError:
-                pass
-
         conf = {}
         if not record:
             for key, macro in self.bindings().items():
@@ -865,6 +939,13 @@ class MacroMode(Mode):
     def __str__(self):
         return self.recording and "record" or "replay"
 
+    def sub_state(self, _state):
+        if self.recording:
+            return True
+
+        # the macros depend on the focused window
+        return str(self.nav.input.window()).lower()
+
     def get_action(self, _state, key, sub_action=None):
         if self.recording:
             if sub_action:
@@ -881,7 +962,7 @@ class MacroMode(Mode):
         if sub_action:
             return sub_action
 
-        macro = self.get_bindings(_state).get(key)
+        macro = self.own_bindings(_state).get(key)
         if not macro:
             return None
 
@@ -923,20 +1004,12 @@ class MacroMode(Mode):
                 return m
         return None
 
-    def macros(self):
-        """mapping from condition -> key -> macro"""
-        return self.nav.state.settings(self, defaultdict(lambda: dict()))
-
     def bindings(self):
         """get mapping from key -> macro"""
 
-        result = {}
-        win = str(self.nav.input.window()).lower()
-        for cond, bindings in self.macros().items():
-            if not cond.lower() in str(win):
-                continue
-            result.update(bindings)
-        logger.debug(result)
+        win = str(self.nav.input.window())
+        result = open_store("macros").lookup(win)
+        logger.debug("bindings for window %s: %s", win, result)
         return result
 
 
@@ -949,7 +1022,7 @@ class MacroMode(Mode):
         bindings = self.bindings()
 
         if not bindings:
-            label = ui.Label()
+            label = ui.Label.acquire()
             label.x = state.screen.width() / 2
             label.y = state.screen.height() / 2
             label.text = "no macros"
@@ -957,7 +1030,7 @@ class MacroMode(Mode):
 
         for key, macro in bindings.items():
             coord = macro[self.POS]
-            label = ui.Label()
+            label = ui.Label.acquire()
             label.x = coord[0]
             label.y = coord[1]
             label.text = "@" + key
@@ -979,49 +1052,95 @@ class MacroMode(Mode):
 
         if cond != None:
             def register_macro(state, key):
-                self.my_macros[cond][key] = {
+                open_store("macros").set(cond, key, {
                         self.POS: [recorded.pos.x, recorded.pos.y],
                         self.CMD: recorded.cmd_sequence,
-                    }
-                self.save(state)
+                    })
 
             state.enter_mode(KeySelectMode(state.nav, register_macro))
 
 
-    def save(self, _state):
-        """save the current macros in a file in the config dir"""
-
-        with open(conf_dir + "macros", "w") as macros_file:
-            macros_file.write(json.dumps(self.macros(), indent=4, sort_keys=True))
-
 
 
 
 class Navigator:
-    def __init__(self):
-        # components
-        self.ui = ui.UserInterface()
+    def __init__(self, history_size=1000):
+        # components, the user interface is created by start_ui
+        self._ui = None
+        self._ui_lock = threading.Lock()
         self.input = input_devices.Input()
 
         # state
         self.state = State(self)
-        self.history = []
+        # label with the active modes, see State.show_status
+        self.status_label = None
+        # snapshots of the previous steps, the oldest are dropped
+        self.history = deque(maxlen=history_size)
 
         # functions
         self.move = self.input.move
+        self.glide = self.input.glide
         self.click = self.input.click
         self.pointer = self.input.pointer
         self.prev_pointer = self.pointer()
 
-        self.draw = self.ui.draw
-        self.undraw = self.ui.undraw
 
         self.key_bindings = self.input.key_bindings
         self.grab_keyboard = self.input.grab_keyboard
         self.ungrab_keyboard = self.input.ungrab_keyboard
 
+        # batches of actions update the user interface only once
+        self.deferring = False
+        self.update_pending = False
+        self.input.batch_handler = self.execute_batch
+
     def __del__(self):
-        self.ui.stop()
+        if self._ui is not None:
+            self._ui.stop()
+
+    @property
+    def ui(self):
+        """The user interface, it is created when it is used for the first time"""
+        if self._ui is None:
+            self.start_ui()
+        return self._ui
+
+    def start_ui(self):
+        """Import the user interface backend and create the user interface, if not done yet"""
+        with self._ui_lock:
+            if self._ui is None:
+                self._ui = load_ui().UserInterface()
+
+    def draw(self, action):
+        self.ui.draw(action)
+
+    def undraw(self, action=None):
+        self.ui.undraw(action)
+
+    def execute_batch(self, batch):
+        """Execute the functions of several key presses (e.g., caused by key autorepeat),
+        and update the state afterwards"""
+
+        self.deferring = True
+        try:
+            for fn in batch:
+                fn()
+        finally:
+            self.deferring = False
+        self.flush_update()
+
+    def flush_update(self):
+        """Execute an update that was deferred by execute_batch"""
+
+        if not self.update_pending:
+            return
+
+        self.update_pending = False
+        deferring, self.deferring = self.deferring, False
+        try:
+            self.state.update()
+        finally:
+            self.deferring = deferring
 
     def execute_actions(self, actions): # TODO: do we need to replace self by a different variable?
         for act in actions:
@@ -1034,43 +1153,56 @@ class Navigator:
     def do_step(self, state):
         """Add the current step to the history"""
 
-        logger.debug("do " + str(state))
-        # TODO: only add state if it has changed
-        # something like
-        #    if len(self.history) == 0: state != self.history[-1]:
-        self.history.append([state.copy(), state.zone.copy()])
+        logger.debug("do %s", state)
+        snapshot = state.snapshot()
+
+        # only add state if it has changed
+        if self.history and self.history[-1] == snapshot:
+            return
+
+        self.history.append(snapshot)
 
     def undo_step(self):
         """Undo last action, i.e., go back one step in history"""
 
+        # the current step has to be in the history before we can go back
+        self.flush_update()
+
         if len(self.history) > 1:
-            del self.history[-1]
+            self.history.pop()
 
             snapshot = self.history[-1]
-            self.state = snapshot[0].copy()
-
-            logger.debug("undo step: setting zone to " + str(snapshot[1]))
-            self.state.zone = snapshot[1].copy()
+            logger.debug("undo step: setting zone to %s", snapshot.zone)
+            self.state.restore(snapshot)
             self.state.update(undoable=False)
 
-            logger.debug("roling back to state " + str(self.state))
+            logger.debug("roling back to state %s", self.state)
 
 class KeyNavigator(Navigator):
     """This class coordinates the input, the user interface, and the history.
     It is the entry point of YAKM"""
 
     def __init__(self):
-        super().__init__()
+        super().__init__(history_size=configuration.get("history_size", 1000))
 
         # setup bindings
+        global_bindings = {}
         for key, action in configuration["bindings"].items():
             if start in action:
                 def _upd(self=self, action=action):
+                    self.start_ui()
                     self.state.enter_mode(Mode(self, configuration["bindings"]))
                     self.execute_actions(action)
                     self.state.update()
 
-                self.input.register_key(key, _upd, _global=True)
+                global_bindings[key] = _upd
+
+        # grab all keys at once
+        self.input.register_keys(global_bindings, _global=True)
+
+        # otherwise the user interface is loaded when the navigation starts for the first time
+        if configuration.get("preload_ui", False):
+            self.start_ui()
 
     def input_dialog(self, msg=""):
         """Ask the user to type in text"""
@@ -1096,12 +1228,82 @@ _globals = globals()
 for i in commands:
     exec_globals[i] = _globals[i]
 
+# compiled configurations and macros: (mode, source code) -> code object
+code_cache = {}
+# number of files in the directory 'code' of the config dir, the least recently used are deleted
+max_code_files = 256
+
+def compile_yakm(code, mode="exec"):
+    """Compile yakm code with mode "exec" or "eval".
+    The code objects are cached in memory, and in the directory 'code' of the config dir."""
+
+    key = (mode, code)
+    try:
+        return code_cache[key]
+    except KeyError:
+        pass
+
+    path = None
+    if conf_dir:
+        # the format of marshal depends on the python version
+        digest = hashlib.sha1(importlib.util.MAGIC_NUMBER + (mode + "\0" + code).encode("utf-8")).hexdigest()
+        path = os.path.join(conf_dir, "code", digest)
+
+    compiled = None
+    if path:
+        try:
+            with open(path, "rb") as code_file:
+                data = code_file.read()
+            if data.startswith(importlib.util.MAGIC_NUMBER):
+                compiled = marshal.loads(data[len(importlib.util.MAGIC_NUMBER):])
+                # the modification time tells which files are in use, see prune_code_files
+                os.utime(path)
+        except FileNotFoundError:
+            pass
+        except (EOFError, ValueError, TypeError):
+            logger.warning("ignoring corrupt code cache file %s", path)
+
+    if compiled is None:
+        compiled = compile(code, "<yakm>", mode)
+        if path:
+            try:
+                pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+                with open(path + ".tmp", "wb") as code_file:
+                    code_file.write(importlib.util.MAGIC_NUMBER + marshal.dumps(compiled))
+                os.replace(path + ".tmp", path)
+                prune_code_files(os.path.dirname(path))
+            except OSError as error:
+                logger.warning("could not write code cache file %s: %s", path, error)
+
+    code_cache[key] = compiled
+    return compiled
+
+def prune_code_files(directory):
+    """Delete the least recently used files of the code cache, so that at most max_code_files remain.
+    Old versions of the configuration and of macros are not used anymore."""
+
+    entries = []
+    for entry in os.scandir(directory):
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            pass
+    if len(entries) <= max_code_files:
+        return
+
+    entries.sort()
+    for _, path in entries[:len(entries) - max_code_files]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
 def exec_yakm(code, local_vars, use_eval=False):
     # read configuration
     if use_eval:
-        return eval(code, exec_globals, local_vars)
+        return eval(compile_yakm(code, "eval"), exec_globals, local_vars)
     else:
-        exec(code, exec_globals, local_vars)
+        exec(compile_yakm(code, "exec"), exec_globals, local_vars)
 
 
 if __name__ == '__main__':
@@ -1141,10 +1343,20 @@ if __name__ == '__main__':
     else:
         print("WARNING: yakm could not open configuration file " + str(conf_file))
 
+    # the environment variable YAKM_LOG_LEVEL takes precedence over the configuration
+    if "log_level" in configuration and "YAKM_LOG_LEVEL" not in os.environ:
+        try:
+            set_log_level(configuration["log_level"])
+        except ValueError as error:
+            logger.warning("%s in the configuration, using the default level", error)
+
     ################################################################################
     # start
     ################################################################################
 
+    # avoid error on ctrl+c; the user interface might be loaded by another thread, which cannot do this
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
     KeyNavigator()
     logger.info("started ...")
 
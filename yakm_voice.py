@@ -7,8 +7,6 @@ import tty
 import threading
 import sys
 from collections import defaultdict
-from time import sleep
-from subprocess import call
 
 from yakm import *
 import ui_gtk as ui
@@ -28,11 +26,12 @@ with command_definitions(lambda: globals()):
 
         mods = list(state.modifiers.keys())
         if "f_key" in mods:
+            mods.remove("f_key")
             if type(key) == int:
                 key = "F" + str(key)
         key = "+".join(mods + [str(key)])
-        logger.trace("pressing key " + str(key))
-        call(["xdotool", "key", str(key)])
+        logger.trace("pressing key %s", key)
+        state.nav.input.press_key(key)
 
     def start(state):
         """Start the navigation. Enters the default mode if no other mode is active"""
@@ -91,13 +90,11 @@ class VoiceMode(Mode):
                 for act in action:
                     act(self.nav.state)
 
-                sleep(0.05)
-
                 if state.mode:
                     mode = state.mode[-1]
                     mode.process(state, keys[1:])
             else:
-                logger.warning("I don't understand '" + str(cmd) + "'")
+                logger.warning("I don't understand '%s'", cmd)
 
     def apply(self, state):
         """Draw visualization of this mode on the screen"""
@@ -134,13 +131,13 @@ class DictateMode(Mode):
             self.type(keys)
 
     def type(self, keys):
-        logger.debug("typing " + str(keys))
+        logger.debug("typing %s", keys)
         text = str(" ".join(keys))
         if not self.first:
             text = " " + text
         self.first = False
 
-        call(["xdotool", "type", text])
+        self.nav.input.type_text(text)
 
 
 class VoiceNavigator(Navigator):
@@ -174,13 +171,14 @@ class VoiceNavigator(Navigator):
             if line == '\n': continue
 
             line = line[:-1]
-            logger.trace(">" + str(line))
+            logger.trace(">%s", line)
 
             self.label.text = line
             self.ui.draw(self.label)
             self.ui.refresh()
 
-            # execute command
+            # execute command, the user might have moved the mouse since the previous one
+            self.input.invalidate_pointer()
             if self.state.mode:
                 mode = self.state.mode[-1]
                 mode.process(self.state, line.split(' '))
@@ -191,7 +189,7 @@ class VoiceNavigator(Navigator):
                         for act in action:
                             act(self.state)
                 else:
-                    logger.error("unknown command: " + str(line))
+                    logger.error("unknown command: %s", line)
 
 
 